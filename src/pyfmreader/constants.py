@@ -3,8 +3,9 @@
 # File extensions of files supported by this library
 jpkfiles = ('jpk-force', 'jpk-force-map', 'jpk-qi-data')        # As in 18-07-2022
 nanoscfiles = ('spm', 'pfc')                                    # As in 18-07-2022
-ufffiles = ('uff')                                              # As in 18-07-2022
-jpkthermalfiles = ('tnd')                                       # As in 18-07-2022
+ufffiles = ('uff',)                                             # As in 18-07-2022
+uffhdf5files = ('uff.h5',)                                      # Binary UFF, see save_uff.saveUFFhdf5
+jpkthermalfiles = ('tnd',)                                      # As in 18-07-2022
 
 # Default values for UFF (Universal File Format) files.
 UFF_code = '_1_2_3_4_5'                                         # Default UFF code for V.0.1.1
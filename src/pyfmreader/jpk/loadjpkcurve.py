@@ -1,27 +1,132 @@
 # File containing the loadJPKcurve function,
 # used to load single force curves from JPK files.
 
-from struct import unpack
-from itertools import groupby
+from functools import partial
+from zipfile import ZipFile
+
 import numpy as np
 
 from ..utils.forcecurve import ForceCurve
 from ..utils.segment import Segment
+from ..utils.lazydict import LazyDict
 from ..constants import JPK_SETPOINT_MODE
 
-def loadJPKcurve(paths, afm_file, curve_index, file_metadata):
+def getJPKchannelconversion(data_type, file_metadata):
+    """
+    Function used to get how to decode and scale the data of a JPK channel.
+
+    The encoder, absolute and nominal scalings of the height channel are folded
+    into a single multiplier and offset, so the data can be converted in one pass:
+    values = raw_data * multiplier + offset
+
+            Parameters:
+                    data_type (str): Name of the channel.
+                    file_metadata (dict): Dictionary containing the file metadata.
+            
+            Returns:
+                    dtype (np.dtype): Big-endian data type of the raw data stored in the file.
+                    multiplier (float): Multiplier to scale the raw data. None if the channel is not converted.
+                    offset (float): Offset to scale the raw data. None if the channel is not converted.
+    """
+    conversion_factors = file_metadata["channel_properties"][data_type]
+    encoder_type = conversion_factors.get("encoder_type")
+    if encoder_type is None or 'integer' in encoder_type:
+        dtype = np.dtype('>i4')
+    elif 'short' in encoder_type:
+        dtype = np.dtype('>i2')
+
+    multiplier, offset = None, None
+    if data_type == file_metadata['height_channel_key']:
+        multiplier = conversion_factors["encoder_multiplier_key"]
+        offset = conversion_factors["encoder_offet_key"]
+        if conversion_factors["absolute_defined"]:
+            multiplier = multiplier * conversion_factors["capSensHeight_abs_mult"]
+            offset = offset * conversion_factors["capSensHeight_abs_mult"] + conversion_factors["capSensHeight_abs_offset"]
+        if conversion_factors["nominal_defined"]:
+            multiplier = multiplier * conversion_factors["capSensHeight_nom_mult"]
+            offset = offset * conversion_factors["capSensHeight_nom_mult"] + conversion_factors["capSensHeight_nom_offset"]
+
+    elif data_type == "vDeflection":
+        multiplier = conversion_factors["encoder_multiplier_key"]
+        offset = conversion_factors["encoder_offet_key"] + conversion_factors["deflection_distance_offset"]
+
+    return dtype, multiplier, offset
+
+def decodeJPKrawdata(filecontents, dtype):
+    """
+    Function used to decode the raw data of a JPK channel.
+
+            Parameters:
+                    filecontents (bytes): Contents of the channel data file.
+                    dtype (np.dtype): Big-endian data type of the raw data, see getJPKchannelconversion.
+            
+            Returns:
+                    data_raw (np.array): Raw data as a native integer array.
+    """
+    nbr_points = len(filecontents) // dtype.itemsize
+    # Decode the big-endian buffer directly into a native integer array.
+    return np.frombuffer(filecontents, dtype, nbr_points).astype(dtype.newbyteorder('='))
+
+def scaleJPKrawdata(data_raw, multiplier, offset, dtype=np.float64):
+    """
+    Function used to convert the raw data of a JPK channel into physical units.
+
+    values = raw_data * multiplier + offset
+
+            Parameters:
+                    data_raw (np.array): Raw data of the channel.
+                    multiplier (float): Multiplier, see getJPKchannelconversion.
+                    offset (float): Offset, see getJPKchannelconversion.
+                    dtype (np.dtype): Floating point type of the converted data.
+            
+            Returns:
+                    values (np.array): Converted data.
+    """
+    # The scaling is computed in double precision, the offset can be
+    # large compared with the result and cancel out most of its digits.
+    return (data_raw * multiplier + offset).astype(dtype, copy=False)
+
+def loadJPKsegmentrawdata(filepath, members):
+    """
+    Function used to load the raw data of a segment from a JPK file.
+
+    Used to load the raw data of segments loaded with raw_data='lazy'.
+
+            Parameters:
+                    filepath (str): Path to the JPK file.
+                    members (dict): Channels of the segment, as {data_type: (member name, dtype string)}.
+            
+            Returns:
+                    segment_raw_data (dict): Raw data of each channel of the segment.
+    """
+    with ZipFile(filepath) as afm_file:
+        return {
+            data_type: decodeJPKrawdata(afm_file.read(name), np.dtype(dtype))
+            for data_type, (name, dtype) in members.items()
+        }
+
+def loadJPKcurve(segments, afm_file, curve_index, file_metadata, raw_data='keep', lazy_conversion=False, dtype=np.float64):
     """
     Function used to load the data of a single force curve from a JPK file.
 
             Parameters:
-                    paths (list): list containing the paths of the files present int the JPK file.
+                    segments (dict): Files of the curve in the JPK file, as {segment_id: {data_type: ZipInfo}}.
+                                     See jpk.loadjpkfile.indexJPKmembers.
                     afm_file (ZipFile): ZipFile buffer containing the data of the JPK file.
                     curve_index (int): Index of curve to load.
                     file_metadata (dict): Dictionary containing the file metadata.
+                    raw_data (str): How the raw data of each segment is kept:
+                                    'keep' to store it, 'drop' to discard it once converted, or 'lazy'
+                                    to discard it and load it again from the file when it is accessed.
+                    lazy_conversion (bool): If True, the channels in segment_formated_data are kept as raw
+                                            data and converted when they are first accessed (see utils.lazydict.LazyDict).
+                    dtype (np.dtype): Floating point type of the converted data (np.float64 or np.float32).
             
             Returns:
                     force_curve (utils.forcecurve.ForceCurve): ForceCurve object containing the loaded data.
     """
+    if raw_data not in ('keep', 'drop', 'lazy'):
+        raise ValueError(f"raw_data must be 'keep', 'drop' or 'lazy', not {raw_data!r}")
     file_id = file_metadata['Entry_filename']
     curve_properties = file_metadata['curve_properties']
     height_channel_key = file_metadata['height_channel_key']
@@ -29,34 +134,17 @@ def loadJPKcurve(paths, afm_file, curve_index, file_metadata):
 
     force_curve = ForceCurve(curve_index, file_id)
 
-    curve_indices = file_metadata["Entry_tot_nb_curve"] - 1
-
-    index = 1 if curve_indices == 0 else 3
+    for segment_id, members in sorted(segments.items(), key=lambda item: int(item[0])):
+        segment_raw_data = {}
+        segment_formated_data = LazyDict() if lazy_conversion else {}
+        raw_members = {}
 
-    keyf = lambda text: text.split("/")[index]
-    groupded_paths = [list(items) for _, items in groupby(sorted(paths), key=keyf)][1:]
+        for data_type, zipinfo in members.items():
 
-    for segment_group in groupded_paths:
-        segment_id = segment_group[0].split("/")[index]
-        segment_raw_data = {}
-        segment_formated_data = {}
-
-        for path in segment_group:
-            data_type = path.split("/")[-1].split(".")[0]
-
-            if data_type not in ['', 'segment-header']:
-                conversion_factors = file_metadata["channel_properties"][data_type]
-                encoder_type = conversion_factors.get("encoder_type")
-                if encoder_type is None or 'integer' in encoder_type:
-                    divider = 4
-                    format_id = 'i'
-                elif 'short' in conversion_factors["encoder_type"]:
-                    divider = 2
-                    format_id = 'h'
-                nbr_points = afm_file.getinfo(path).file_size // divider
-                filecontents = afm_file.read(path)
-                data_raw = unpack(f">{str(nbr_points)}{format_id}", filecontents)
-                segment_raw_data[data_type] = data_raw
+            if data_type != 'segment-header':
+                rawdtype, _, _ = getJPKchannelconversion(data_type, file_metadata)
+                segment_raw_data[data_type] = decodeJPKrawdata(afm_file.read(zipinfo), rawdtype)
+                raw_members[data_type] = (zipinfo.filename, rawdtype.str)
         
         # If no data found, continue to next segment.
         if len(segment_raw_data) == 0:
@@ -67,31 +155,22 @@ def loadJPKcurve(paths, afm_file, curve_index, file_metadata):
 
         # Transform Height data
         if height_channel_key is not None:
-            raw_data = segment_raw_data[height_channel_key]
-            raw_data = np.asarray(raw_data)
-            conversion_factors = file_metadata["channel_properties"][height_channel_key]
-            values = raw_data * conversion_factors["encoder_multiplier_key"] + conversion_factors["encoder_offet_key"]
-
-            if conversion_factors["absolute_defined"]:
-                values = values * conversion_factors["capSensHeight_abs_mult"] +  conversion_factors["capSensHeight_abs_offset"]
-
-            if conversion_factors["nominal_defined"]:
-                values = values * conversion_factors["capSensHeight_nom_mult"] +  conversion_factors["capSensHeight_nom_offset"]
-
-            segment_formated_data[height_channel_key] = values
+            _, multiplier, offset = getJPKchannelconversion(height_channel_key, file_metadata)
+            if lazy_conversion:
+                segment_formated_data.set_lazy(height_channel_key, partial(scaleJPKrawdata, segment_raw_data[height_channel_key], multiplier, offset, dtype))
+            else:
+                segment_formated_data[height_channel_key] = scaleJPKrawdata(segment_raw_data[height_channel_key], multiplier, offset, dtype)
 
         else:
             print("[!] No valid height channel found!")
 
         # Transform vDeflection data
         if found_vDeflection:
-            raw_data = segment_raw_data["vDeflection"]
-            raw_data = np.asarray(raw_data)
-            conversion_factors = file_metadata["channel_properties"]["vDeflection"]
-            segment_formated_data["vDeflection"] = raw_data * \
-                conversion_factors["encoder_multiplier_key"] + \
-                conversion_factors["encoder_offet_key"] + \
-                conversion_factors["deflection_distance_offset"]
+            _, multiplier, offset = getJPKchannelconversion("vDeflection", file_metadata)
+            if lazy_conversion:
+                segment_formated_data.set_lazy("vDeflection", partial(scaleJPKrawdata, segment_raw_data["vDeflection"], multiplier, offset, dtype))
+            else:
+                segment_formated_data["vDeflection"] = scaleJPKrawdata(segment_raw_data["vDeflection"], multiplier, offset, dtype)
 
         else:
             print("[!] No valid vDeflection channel found!")
@@ -101,7 +180,10 @@ def loadJPKcurve(paths, afm_file, curve_index, file_metadata):
         segment_num_points = curve_properties[str(curve_index)][segment_id]["num_points"]
 
         # TO DO: Time can be exported, handle this situation.
-        segment_formated_data["time"] = np.linspace(0, segment_duration, segment_num_points, endpoint=False)
+        if lazy_conversion:
+            segment_formated_data.set_lazy("time", partial(np.linspace, 0, segment_duration, segment_num_points, endpoint=False, dtype=dtype))
+        else:
+            segment_formated_data["time"] = np.linspace(0, segment_duration, segment_num_points, endpoint=False, dtype=dtype)
 
         if segment_type=='extend': segment_type='Approach'
         elif segment_type == 'pause': segment_type = 'Pause'
@@ -110,7 +192,10 @@ def loadJPKcurve(paths, afm_file, curve_index, file_metadata):
 
         segment = Segment(file_id, segment_id, segment_type)
         segment.segment_formated_data = segment_formated_data
-        segment.segment_raw_data = segment_raw_data
+        if raw_data == 'keep':
+            segment.segment_raw_data = segment_raw_data
+        elif raw_data == 'lazy':
+            segment.set_raw_loader(partial(loadJPKsegmentrawdata, file_metadata['file_path'], raw_members))
         segment.segment_metadata = curve_properties[str(curve_index)][segment_id]
         segment.force_setpoint_mode = JPK_SETPOINT_MODE
         segment.nb_point = segment_num_points
@@ -1,10 +1,10 @@
 import os
-from itertools import groupby
 from zipfile import ZipFile
 from .parsejpkheader import parseJPKheader, parseJPKsegmentheader
 from .loadjpkimg import loadJPKimg
+from ..utils.metadatacache import loadmetadatacache, savemetadatacache
 
-def loadJPKfile(filepath, UFF, filesuffix):
+def loadJPKfile(filepath, UFF, filesuffix, lazy=False, metadata_cache=False):
     """
     Function used to load the metadata of a JPK file.
 
@@ -12,10 +12,26 @@ def loadJPKfile(filepath, UFF, filesuffix):
                     filepath (str): Path to the JPK file.
                     UFF (uff.UFF): UFF object to load the metadata into.
                     filesuffix (str): JPK file extension.
+                    lazy (bool): If True, only the segment headers of the first curve are parsed.
+                                 The segment headers of the other curves are parsed when they are loaded.
+                    metadata_cache (bool): If True, load the metadata from the persistent metadata cache
+                                           if available, and save it there otherwise (see utils.metadatacache).
             
             Returns:
                     UFF (uff.UFF): UFF object containing the loaded metadata.
     """
+    if metadata_cache:
+        state = loadmetadatacache(filepath)
+        # Metadata cached in lazy mode does not contain all the segment headers.
+        if state is not None and (lazy or state['complete']):
+            UFF.filemetadata = state['filemetadata']
+            UFF.filemetadata['file_path'] = filepath
+            UFF.isFV = bool(UFF.filemetadata['force_volume'])
+            UFF.imagedata = state['imagedata']
+            UFF._sharedataprops = state['sharedataprops']
+            UFF._zipindex = state['zipindex']
+            return UFF
+
     with open(filepath, 'rb') as file:
         afm_file = ZipFile(file)
         # Get global metadata stored in the files: header.properties and shared-data/header.properties
@@ -30,54 +46,22 @@ def loadJPKfile(filepath, UFF, filesuffix):
         UFF.filemetadata = parseJPKheader(filepath, header_properties, UFF._sharedataprops, filesuffix)
         UFF.isFV = bool(UFF.filemetadata['force_volume'])
 
-        paths = [name for name in afm_file.namelist() if "segments" in name]
-
         if filesuffix in ("jpk-force-map", "jpk-qi-data"):
-            # Function to group paths by index
-            group_keyf = lambda text: int(text.split("/")[1])
-            # Function to sort lists of paths by the index
-            list_keyf = lambda list: int(list[0].split("/")[1])
-            # Group all the paths of the same index
-            grouped_paths = [list(items) for _, items in groupby(paths, key=group_keyf)]
-            # Sort the path groups based on index
-            grouped_paths = sorted(grouped_paths, key=list_keyf)
             # Load image data if scan
-            UFF.imagedata = loadJPKimg(UFF)
-
-        else:
-            # If not a map, all paths correspond to the same curve.
-            grouped_paths = [paths]
-        
-        UFF._groupedpaths = grouped_paths
-
-        curve_properties = {}
-
-        curve_indices = UFF.filemetadata["Entry_tot_nb_curve"] - 1
-
-        index = 1 if curve_indices == 0 else 3
+            UFF.imagedata = loadJPKimg(UFF, afm_file)
 
-        keyf = lambda text: text.split("/")[index]
-        groupded_paths = [list(items) for _, items in groupby(sorted(paths), key=keyf)][1:]
+        # The segment files of each curve are found with the index of the ZipFile members.
+        UFF._zipindex = indexJPKmembers(afm_file, filesuffix)
 
-        for segment_group in groupded_paths:
-            if index == 3:
-                curve_id = segment_group[0].split("/")[1]
-            else:
-                curve_id = '0'
-            segment_id = segment_group[0].split("/")[index]
-            if not curve_id in curve_properties.keys():
-                curve_properties.update({curve_id:{}})
+        UFF.filemetadata['curve_properties'] = {}
 
-            for path in segment_group:
-                data_type = path.split("/")[-1].split(".")[0]
+        # Parse the segment headers of the first curve to find the channels saved.
+        # In lazy mode, the segment headers of the other curves are parsed on first access.
+        curve_indices = UFF._zipindex.keys() if not lazy else [0]
+        for curve_index in curve_indices:
+            loadJPKcurveproperties(afm_file, UFF, curve_index)
 
-                if data_type == 'segment-header':
-                    metadatacontents = afm_file.read(path)
-                    metadata_raw = bytes(metadatacontents).decode().splitlines()
-                    # segment_metadata = jprops.load_properties(metadata_raw)
-                    segment_metadata = {item.split("=")[0]:item.split("=")[1] for item in metadata_raw if not item.startswith("#")}
-                    curve_properties = parseJPKsegmentheader(curve_properties, curve_id, filesuffix, segment_metadata, UFF._sharedataprops, segment_id)
-        
+        curve_properties = UFF.filemetadata['curve_properties']
         channels = curve_properties['0']['0']['channels']
 
         # Deflection channels
@@ -93,6 +77,79 @@ def loadJPKfile(filepath, UFF, filesuffix):
         UFF.filemetadata['found_vDeflection'] = found_vDeflection
         UFF.filemetadata['height_channel_key'] = height_channel_key
 
-        UFF.filemetadata['curve_properties'] = curve_properties
+    if metadata_cache:
+        savemetadatacache(filepath, {
+            'filemetadata': UFF.filemetadata,
+            'imagedata': UFF.imagedata,
+            'sharedataprops': UFF._sharedataprops,
+            'zipindex': UFF._zipindex,
+            'complete': not lazy
+        })
+
+    return UFF
+
+def indexJPKmembers(afm_file, filesuffix):
+    """
+    Function used to index the segment files stored in a JPK file.
+
+    The index is built once from the ZipFile central directory, so the
+    members of any curve can be found without sorting or grouping paths.
+
+            Parameters:
+                    afm_file (ZipFile): ZipFile buffer containing the data of the JPK file.
+                    filesuffix (str): JPK file extension.
+            
+            Returns:
+                    zipindex (dict): Dictionary as {curve_index (int): {segment_id (str): {data_type (str): ZipInfo}}}.
+                                     The data_type is the channel name or 'segment-header'.
+    """
+    zipindex = {}
+    isMap = filesuffix in ("jpk-force-map", "jpk-qi-data")
+    for zipinfo in afm_file.infolist():
+        # Maps: index/{curve_index}/segments/{segment_id}/...
+        # Single curves: segments/{segment_id}/...
+        path = zipinfo.filename.split("/")
+        if isMap:
+            if len(path) < 5 or path[0] != "index" or path[2] != "segments":
+                continue
+            curve_index, segment_id = int(path[1]), path[3]
+        else:
+            if len(path) < 3 or path[0] != "segments":
+                continue
+            curve_index, segment_id = 0, path[1]
+        data_type = path[-1].split(".")[0]
+        # Skip directory entries
+        if data_type == '':
+            continue
+        zipindex.setdefault(curve_index, {}).setdefault(segment_id, {})[data_type] = zipinfo
+    return zipindex
+
+def loadJPKcurveproperties(afm_file, UFF, curve_index):
+    """
+    Function used to load the metadata of each segment of a single force curve of a JPK file.
+
+    The metadata is stored in UFF.filemetadata['curve_properties'][str(curve_index)].
+
+            Parameters:
+                    afm_file (ZipFile): ZipFile buffer containing the data of the JPK file.
+                    UFF (uff.UFF): UFF object containing the JPK file metadata.
+                    curve_index (int): Index of the force curve.
+            
+            Returns:
+                    curve_properties (dict): Dictionary containing the metadata for each loaded force curve in the file.
+    """
+    filesuffix = UFF.filemetadata['file_type']
+    curve_properties = UFF.filemetadata['curve_properties']
+
+    curve_id = str(curve_index)
+    if not curve_id in curve_properties.keys():
+        curve_properties.update({curve_id:{}})
+
+    for segment_id, members in sorted(UFF._zipindex[curve_index].items(), key=lambda item: int(item[0])):
+        if 'segment-header' in members:
+            metadatacontents = afm_file.read(members['segment-header'])
+            metadata_raw = bytes(metadatacontents).decode().splitlines()
+            segment_metadata = {item.split("=")[0]:item.split("=")[1] for item in metadata_raw if not item.startswith("#")}
+            curve_properties = parseJPKsegmentheader(curve_properties, curve_id, filesuffix, segment_metadata, UFF._sharedataprops, segment_id)
 
-    return UFF
\ No newline at end of file
+    return curve_properties
\ No newline at end of file
@@ -6,6 +6,8 @@ import numpy as np
 import tifffile
 from zipfile import ZipFile
 
+from .loadjpkcurve import getJPKchannelconversion
+
 # As for 20/07/2022 these are the accepted channels for
 # JPK files. This routine has a lot of hard coded values
 # i.e: offset to search for the conversion factors, that are
@@ -22,6 +24,11 @@ height_channels = [
     'Height(measured)', 'Height'
 ]
 
+# Image channel containing the same height as each curve height channel.
+height_image_channels = {
+    'measuredHeight': 'Height(measured)', 'height': 'Height'
+}
+
 valid_height_scalings = [
     'Calibrated height', 'Nominal height'
 ]
@@ -69,7 +76,7 @@ def get_channel_conversion_factors(tif_tags_list, channel_name):
     # print(mult, offset)
     return mult, offset
 
-def loadJPKimg(UFF):
+def loadJPKimg(UFF, afm_file=None):
     """
     Returns the contents of the data-image file inside the JPK file.
     This file is structured in a tiff like strucure, with each channel
@@ -80,6 +87,8 @@ def loadJPKimg(UFF):
     
             Parameters:
                     UFF (uff.UFF): UFF object containing the JPK file metadata.
+                    afm_file (ZipFile): ZipFile buffer containing the data of the JPK file (optional).
+                                        If None, the file is opened and closed by this function.
             
             Returns:
                     imagedata (dict): dictionary containing all the channels data.
@@ -88,66 +97,106 @@ def loadJPKimg(UFF):
     if file_type == "jpk-force-map": path = 'data-image.force'
     elif file_type == "jpk-qi-data": path = 'data-image.jpk-qi-image'
     else: return
-    with open(UFF.filemetadata['file_path'], 'rb') as file:
-        afm_file = ZipFile(file)
-        bytes_io = io.BytesIO(afm_file.read(path))
-        with tifffile.TiffFile(bytes_io) as tif:
-            data = {}
-            channel_name = None
-            for page in tif.pages[1:]:
-                tif_tags = [tag.value for tag in page.tags.values()]
-                # print(tif_tags)
-                for tag in tif_tags:
-                    # print(tag)
-                    with contextlib.suppress(TypeError):
-                        if 'algorithm.object-name.base-object-name.fancy-name' in tag:
-                            channel_name = tag.split('\n')[0].split(':')[1].replace(' ', '')
-                if channel_name not in  valid_channels:
-                    continue
-                # Try to fetch the multiplier and offset.
-                mult, offset = get_channel_conversion_factors(tif_tags, channel_name)
-                # Check if the multiplier and the offset have been extracted properly.
-                # In the test files it works correctly. But weird things may happen with
-                # other files.
-                if isinstance(mult, float) and isinstance(offset, float):
-                    image = page.asarray()
-                    data[channel_name] = image.astype(np.int64) * mult + offset
+    if afm_file is None:
+        with open(UFF.filemetadata['file_path'], 'rb') as file:
+            return loadJPKimg(UFF, ZipFile(file))
+    bytes_io = io.BytesIO(afm_file.read(path))
+    with tifffile.TiffFile(bytes_io) as tif:
+        data = {}
+        channel_name = None
+        for page in tif.pages[1:]:
+            tif_tags = [tag.value for tag in page.tags.values()]
+            # print(tif_tags)
+            for tag in tif_tags:
+                # print(tag)
+                with contextlib.suppress(TypeError):
+                    if 'algorithm.object-name.base-object-name.fancy-name' in tag:
+                        channel_name = tag.split('\n')[0].split(':')[1].replace(' ', '')
+            if channel_name not in  valid_channels:
+                continue
+            # Try to fetch the multiplier and offset.
+            mult, offset = get_channel_conversion_factors(tif_tags, channel_name)
+            # Check if the multiplier and the offset have been extracted properly.
+            # In the test files it works correctly. But weird things may happen with
+            # other files.
+            if isinstance(mult, float) and isinstance(offset, float):
+                image = page.asarray()
+                data[channel_name] = image.astype(np.int64) * mult + offset
     return data
 
-def computeJPKPiezoImg(UFF):
+def getJPKapproachid(UFF):
+    """
+    Function used to get the id of the first approach (extend) segment
+    of the force curves in a JPK force map or QI file.
+
+            Parameters:
+                    UFF (uff.UFF): UFF object containing the JPK file metadata.
+            
+            Returns:
+                    segment_id (str): Id of the first approach segment.
+    """
+    for segment_id in range(UFF.filemetadata["Recording_number_segment"]):
+        style = UFF._sharedataprops.get(f"force-segment-header-info.{segment_id}.settings.style")
+        if style == "extend":
+            return str(segment_id)
+    return '0'
+
+def computeJPKPiezoImg(UFF, afm_file=None, use_imagedata=True):
     """
     Function used to compute the piezo image of a JPK file.
 
+    If use_imagedata is True and the image data of the file contains the height
+    channel matching the height channel of the curves (see height_image_channels),
+    it is used directly. This is the height image recorded by the instrument, which
+    is not the last approach value of each curve: in the bundled force map they
+    differ by up to 17% of the image range.
+    Otherwise, only the height channel of the first approach segment of each curve
+    is read, and only its last value is decoded.
+
             Parameters:
                     UFF (uff.UFF): UFF object containing the JPK file metadata.
+                    afm_file (ZipFile): ZipFile buffer containing the data of the JPK file (optional).
+                                        If None, the file is opened and closed by this function.
+                    use_imagedata (bool): If True, use the height image stored in UFF.imagedata when available.
+                                          If False, use the last value of the first approach segment of each curve.
             
             Returns:
                     piezoimg (np.array): 2D array containing the piezo image of the JPK file.
     """
     file_type = UFF.filemetadata['file_type']
     height_channel_key = UFF.filemetadata["height_channel_key"]
-    if file_type in ("jpk-force-map", "jpk-qi-data"):
-        # Get height key
-        # Get the last value of the first approach segment.
+    if file_type not in ("jpk-force-map", "jpk-qi-data"):
+        return
+    channel_name = height_image_channels.get(height_channel_key)
+    if use_imagedata and UFF.imagedata and channel_name in UFF.imagedata:
+        # The image data is already stored following the raster scan direction.
+        tempiezoimg = UFF.imagedata[channel_name]
+        return tempiezoimg - np.min(tempiezoimg)
+    if afm_file is None:
         with open(UFF.filemetadata['file_path'], 'rb') as file:
-            afm_file = ZipFile(file)
-            tempiezoimg = np.array(
-                [UFF._loadcurve(idx, afm_file, file_type).extend_segments[0][1].segment_formated_data[height_channel_key][-1] for idx in range(UFF.filemetadata['Entry_tot_nb_curve'])]
-            )
-        # Rescale piezo image (0 - maxval)
-        piezoimg = tempiezoimg - np.min(tempiezoimg)
-        # Reshape piezo image
-        piezoimg = piezoimg.reshape((UFF.filemetadata["num_x_pixels"], UFF.filemetadata["num_y_pixels"]))
-        if file_type == "jpk-force-map":
-            # Flip odd rows to follow raster scan direction properly.
-            #   0  1  2       0  1  2
-            #   3  4  5  -->  5  4  3
-            #   6  7  8       6  7  8 
-            piezoimg = np.asarray([row[::(-1)**i] for i, row in enumerate(piezoimg)])
-        else:
-            # In QI files it is not recessary to flip rows
-            # due to how the acquisition mode works.
-            piezoimg = piezoimg
+            return computeJPKPiezoImg(UFF, ZipFile(file), use_imagedata)
+    # Get the last value of the height channel in the first approach segment.
+    segment_id = getJPKapproachid(UFF)
+    dtype, multiplier, offset = getJPKchannelconversion(height_channel_key, UFF.filemetadata)
+    tempiezoimg = np.empty(UFF.filemetadata['Entry_tot_nb_curve'])
+    for idx in range(UFF.filemetadata['Entry_tot_nb_curve']):
+        filecontents = afm_file.read(UFF._zipindex[idx][segment_id][height_channel_key])
+        tempiezoimg[idx] = np.frombuffer(filecontents[-dtype.itemsize:], dtype)[0]
+    tempiezoimg = tempiezoimg * multiplier + offset
+    # Rescale piezo image (0 - maxval)
+    piezoimg = tempiezoimg - np.min(tempiezoimg)
+    # Reshape piezo image
+    piezoimg = piezoimg.reshape((UFF.filemetadata["num_x_pixels"], UFF.filemetadata["num_y_pixels"]))
+    if file_type == "jpk-force-map":
+        # Flip odd rows to follow raster scan direction properly.
+        #   0  1  2       0  1  2
+        #   3  4  5  -->  5  4  3
+        #   6  7  8       6  7  8 
+        piezoimg = np.asarray([row[::(-1)**i] for i, row in enumerate(piezoimg)])
+    else:
+        # In QI files it is not recessary to flip rows
+        # due to how the acquisition mode works.
+        piezoimg = piezoimg
     
     return piezoimg
 
@@ -3,6 +3,8 @@
 # Reference: N/A
 
 import os
+import io
+import json
 from .utils.forcecurve import ForceCurve
 from .utils.segment import Segment
 import numpy as np
@@ -21,39 +23,240 @@ def loadUFFheader(uffpath):
         'file_path': uffpath,
         "file_size_bytes": os.path.getsize(uffpath)
     }
-    header["file_type"] = os.path.splitext(uffpath)[-1]
+    # Extension without the leading dot, as for the other supported formats.
+    header["file_type"] = os.path.splitext(uffpath)[-1][1:]
+    index = loadUFFindex(uffpath)
     with open(uffpath, 'r') as file:
-        for line in file.readlines():
-            if 'HE' in line:
+        # With an index, only the lines between the data blocks are read.
+        lines = file if index is None else readUFFheaderlines(uffpath, index)
+        for line in lines:
+            # Data lines are skipped without being split.
+            if line.startswith('HE'):
                 splitline = line.split(' ', 1)[-1].split(':', 1)
                 field = splitline[0]
                 val = splitline[-1].lstrip().strip(' \n"')
                 try: val = float(val)
                 except ValueError: val = val
                 header[field] = val
+    # A txt UFF file contains a single curve, the number of curves
+    # of the file it was exported from is kept as source_Entry_tot_nb_curve.
+    header['source_Entry_tot_nb_curve'] = int(header.get('Entry_tot_nb_curve', 1))
+    header['Entry_tot_nb_curve'] = 1
     return header
 
-def loadUFFcurve(header):
+def getUFFindexpath(uffpath):
+    """
+    Get the path of the sidecar index file of a txt UFF file.
+
+            Parameters:
+                    uffpath (str): Path to the txt UFF file.
+            
+            Returns:
+                    indexpath (str): Path to the index file.
+    """
+    return uffpath + '.idx'
+
+def buildUFFindex(uffpath):
+    """
+    Build the index of the data blocks of a txt UFF file.
+
+    The index stores, for each segment, the byte offset of its first data line,
+    the length of its data block in bytes and its number of data lines.
+    The size and modification time of the file are stored to detect changes.
+
+            Parameters:
+                    uffpath (str): Path to the txt UFF file.
+            
+            Returns:
+                    index (dict): Dictionary containing the size and modification time of
+                                  the file and the position of the data block of each segment.
+    """
+    segments = {}
+    lastsegid = None
+    offset = 0
+    with open(uffpath, 'rb') as file:
+        mtime_ns = os.fstat(file.fileno()).st_mtime_ns
+        for line in file:
+            linedata = line.split(None, 2)
+            if not line.startswith(b'HE') and len(linedata) >= 3:
+                segid = linedata[1].decode()
+                if segid != lastsegid:
+                    if segid in segments:
+                        raise ValueError(f"The data lines of segment {segid} are not contiguous in {uffpath}.")
+                    segments[segid] = [offset, 0, 0]
+                    lastsegid = segid
+                segments[segid][1] += len(line)
+                segments[segid][2] += 1
+            else:
+                lastsegid = None
+            offset += len(line)
+    return {'file_size_bytes': offset, 'file_mtime_ns': mtime_ns, 'segments': segments}
+
+def saveUFFindex(uffpath, index=None):
+    """
+    Save the index of a txt UFF file into its sidecar index file (file_name.uff.idx).
+
+            Parameters:
+                    uffpath (str): Path to the txt UFF file.
+                    index (dict): Index to save. If None, it is built with buildUFFindex.
+            
+            Returns:
+                    index (dict): Saved index.
+    """
+    if index is None:
+        index = buildUFFindex(uffpath)
+    with open(getUFFindexpath(uffpath), 'w') as f:
+        json.dump(index, f)
+    return index
+
+def loadUFFindex(uffpath):
+    """
+    Load the sidecar index of a txt UFF file, if available.
+
+    The index is ignored if the size or the modification time of the txt UFF file
+    do not match the indexed ones.
+
+            Parameters:
+                    uffpath (str): Path to the txt UFF file.
+            
+            Returns:
+                    index (dict): Index of the file, or None if not available.
+    """
+    indexpath = getUFFindexpath(uffpath)
+    if not os.path.isfile(indexpath):
+        return None
+    try:
+        with open(indexpath, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(uffpath)
+    if index.get('file_size_bytes') != stat.st_size or index.get('file_mtime_ns') != stat.st_mtime_ns:
+        return None
+    return index
+
+def readUFFheaderlines(uffpath, index):
+    """
+    Generator used to read the lines of a txt UFF file outside of the indexed data blocks.
+
+            Parameters:
+                    uffpath (str): Path to the txt UFF file.
+                    index (dict): Index of the file, see buildUFFindex.
+            
+            Yields:
+                    line (str): Header line, with universal newlines as when the file is read in text mode.
+    """
+    position = 0
+    with open(uffpath, 'rb') as file:
+        for offset, nbytes, _ in sorted(index['segments'].values()):
+            file.seek(position)
+            yield from io.StringIO(file.read(offset - position).decode('utf-8'), newline=None)
+            position = offset + nbytes
+        file.seek(position)
+        yield from io.StringIO(file.read().decode('utf-8'), newline=None)
+
+def readUFFdatalines(ufffile):
+    """
+    Read the data lines of an UFF AFM file in a single pass, grouped by segment.
+
+            Parameters:
+                    ufffile (file object): Open text buffer of the UFF file.
+            
+            Returns:
+                    datalines (dict): Dictionary containing the data lines of each segment,
+                                      using the segment number as key.
+    """
+    ufffile.seek(0)
+    datalines = {}
+    for line in ufffile:
+        if line.startswith('HE'): continue
+        linedata = line.split(None, 2)
+        # Skip blank lines and the end of file marker.
+        if len(linedata) < 3: continue
+        datalines.setdefault(linedata[1], []).append(line)
+    return datalines
+
+def parseUFFsegmentdata(lines, npoints, ncols, dtype=np.float64):
+    """
+    Parse the data lines of an UFF segment into an array.
+
+            Parameters:
+                    lines (list): Data lines of the segment.
+                    npoints (int): Number of points of the segment.
+                    ncols (int): Number of data columns of the segment.
+                    dtype (np.dtype): Floating point type of the segment data.
+            
+            Returns:
+                    segdata (np.array): Array of shape (npoints, ncols) containing the segment data.
+    """
+    segdata = np.zeros((npoints, ncols), dtype=dtype)
+    if lines and ncols:
+        # The first two columns contain the segment code and number.
+        values = np.loadtxt(lines, usecols=range(2, 2 + ncols), ndmin=2, dtype=dtype)
+        segdata[:len(values)] = values[:npoints]
+    return segdata
+
+def readUFFindexedlines(ufffile, index, segids):
+    """
+    Read the data lines of the selected segments of a txt UFF file, using its index.
+
+            Parameters:
+                    ufffile (file object): Open text buffer of the UFF file.
+                    index (dict): Index of the file, see buildUFFindex.
+                    segids (list): Numbers of the segments to read.
+            
+            Returns:
+                    datalines (dict): Dictionary containing the data lines of each segment,
+                                      using the segment number as key.
+    """
+    datalines = {}
+    for segid in segids:
+        block = index['segments'].get(str(segid))
+        if block is None: continue
+        offset, _, nlines = block
+        ufffile.seek(offset)
+        datalines[str(segid)] = [ufffile.readline() for _ in range(nlines)]
+    return datalines
+
+def loadUFFcurve(header, ufffile=None, segments=None, dtype=np.float64):
     """
     Load the data of an UFF AFM file.
 
+    If the file has a sidecar index (see saveUFFindex), only the data
+    blocks of the selected segments are read.
+
             Parameters:
                     header (dict): Dictionary containing the UFF header information.
+                    ufffile (file object): Open text buffer of the UFF file (optional).
+                                           If None, the file is opened and closed by this function.
+                    segments (iterable): Numbers of the segments to load. If None, all the segments are loaded.
+                    dtype (np.dtype): Floating point type of the loaded data (np.float64 or np.float32).
             
             Returns:
                     fdc (utils.forcecurve.ForceCurve): Force Distance Curve data stored in UFF.
     """
-    uffpath = header['file_path']
+    if ufffile is None:
+        with open(header['file_path'], 'r') as ufffile:
+            return loadUFFcurve(header, ufffile, segments, dtype)
+
     idx = int(header['Recording_curve_id'])
     filename = header['Entry_filename']
     fdc = ForceCurve(idx, filename)
-    for segid in range(int(header['Recording_number_segment'])):
+    segids = range(int(header['Recording_number_segment']))
+    if segments is not None:
+        selected = set(map(int, segments))
+        segids = [segid for segid in segids if segid in selected]
+    index = loadUFFindex(header['file_path'])
+    if index is None:
+        datalines = readUFFdatalines(ufffile)
+    else:
+        datalines = readUFFindexedlines(ufffile, index, segids)
+    for segid in segids:
         segtype = header[f'Recording_segment_{segid}_type']
-        segcode = header[f'Recording_segment_{segid}_code']
         npoints = int(header[f'Recording_segment_{segid}_nb_point'])
         ncols = int(header[f'Recording_segment_{segid}_nb_col'])
 
-        segdata = np.zeros((npoints, ncols))
+        segdata = parseUFFsegmentdata(datalines.get(str(segid), []), npoints, ncols, dtype)
         segment = Segment(filename, str(segid), segtype)
         segment.nb_point = npoints
         segment.nb_col = ncols
@@ -63,13 +266,6 @@ def loadUFFcurve(header):
         segment.sampling_rate = header[f'Recording_segment_{segid}_sampling_rate(Hz)']
         segment.z_displacement = header[f'Recording_segment_{segid}_z_displacement(m)']
 
-        with open(uffpath, 'r') as file:
-            i = 0
-            for line in file.readlines():
-                linedata = line.split()
-                if linedata[0] != segcode: continue
-                for j, value in enumerate(linedata[2:]): segdata[i,j] = value
-                i+=1
         for colidx in range(ncols):
             colkey = header[f'Recording_segment_{segid}_col_{colidx}_title']
             if segment.segment_formated_data is None:
@@ -94,4 +290,117 @@ def loadUFFtxt(uffpath, UFF):
                     UFF (uff.UFF): Universal File Format object containing loaded data.
     """
     UFF.filemetadata = loadUFFheader(uffpath)
-    return UFF
\ No newline at end of file
+    return UFF
+
+def loadUFFhdf5(uffpath, UFF):
+    """
+    Load the metadata of a binary UFF AFM file, saved with save_uff.saveUFFhdf5.
+
+    Only the metadata and the image data are read, the curves are read when they are loaded.
+
+    Requires the h5py package.
+
+            Parameters:
+                    uffpath (str): Path to the file.
+                    UFF (uff.UFF): Universal File Format object to store loaded data.
+            
+            Returns:
+                    UFF (uff.UFF): Universal File Format object containing loaded data.
+    """
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("The h5py package is required to load UFF files in HDF5 format.")
+    with h5py.File(uffpath, 'r') as h5file:
+        header = json.loads(h5file.attrs['filemetadata'])
+        header['source_file_type'] = header.get('file_type')
+        header['file_path'] = uffpath
+        header['file_size_bytes'] = os.path.getsize(uffpath)
+        header['file_type'] = 'uff.h5'
+        header['Entry_tot_nb_curve'] = int(h5file['segments'].attrs['nb_curves'])
+        # Segment metadata is read with each curve.
+        header['curve_properties'] = {}
+        UFF.filemetadata = header
+        UFF.isFV = bool(header.get('force_volume', 0))
+        if 'imagedata' in h5file:
+            UFF.imagedata = {channel: image[()] for channel, image in h5file['imagedata'].items()}
+    return UFF
+
+def readUFFhdf5slice(dataset, start, end, dtype):
+    """
+    Read a slice of a dataset of a binary UFF file, converted to the given type while it is read.
+
+            Parameters:
+                    dataset (h5py.Dataset): Data array of a segment column.
+                    start (int): Position of the first value.
+                    end (int): Position after the last value.
+                    dtype (np.dtype): Floating point type of the returned data.
+            
+            Returns:
+                    data (np.array): Slice of the dataset.
+    """
+    if dataset.dtype == dtype:
+        return dataset[start:end]
+    data = np.empty(end - start, dtype=dtype)
+    dataset.read_direct(data, np.s_[start:end])
+    return data
+
+def loadUFFhdf5curve(idx, header, h5file, dtype=np.float64):
+    """
+    Load the data of a single force curve from a binary UFF AFM file.
+
+    Only the slices of the datasets belonging to the curve are read.
+
+            Parameters:
+                    idx (int): Index of the force curve.
+                    header (dict): Dictionary containing the UFF header information.
+                    h5file (h5py.File): Open binary UFF file.
+                    dtype (np.dtype): Floating point type of the loaded data (np.float64 or np.float32).
+            
+            Returns:
+                    fdc (utils.forcecurve.ForceCurve): Force Distance Curve data stored in UFF.
+    """
+    dtype = np.dtype(dtype)
+    filename = header['Entry_filename']
+    fdc = ForceCurve(idx, filename)
+    segments = h5file['segments']
+    for segid in sorted(segments.keys(), key=int):
+        group = segments[segid]
+        start, end = group['offsets'][idx:idx+2]
+        # Segments missing in this curve are saved with length 0.
+        if start == end:
+            continue
+        segtype = group.attrs['segment_type']
+        segment = Segment(filename, segid, segtype)
+        segment.segment_formated_data = {column: readUFFhdf5slice(group['data'][column], start, end, dtype) for column in group.attrs['columns']}
+        segment.nb_point = int(end - start)
+        segment.nb_col = len(segment.segment_formated_data)
+        description = group.attrs['description']
+        segment.description = None if description == 'None' else description
+        segment.force_setpoint_mode = group.attrs['force_setpoint_mode']
+        segment.force_setpoint = float(group['force_setpoint'][idx])
+        segment.velocity = float(group['velocity'][idx])
+        segment.sampling_rate = float(group['sampling_rate'][idx])
+        segment.z_displacement = float(group['z_displacement'][idx])
+        metadata = group['metadata'][idx]
+        if isinstance(metadata, bytes): metadata = metadata.decode()
+        if metadata: segment.segment_metadata = json.loads(metadata)
+        if segtype == 'Approach': fdc.extend_segments.append((int(segid), segment))
+        elif segtype == 'Retract': fdc.retract_segments.append((int(segid), segment))
+        elif segtype == 'Pause': fdc.pause_segments.append((int(segid), segment))
+        elif segtype == 'Modulation': fdc.modulation_segments.append((int(segid), segment))
+    return fdc
+
+def loadUFFhdf5img(h5file):
+    """
+    Load the piezo image from a binary UFF AFM file.
+
+            Parameters:
+                    h5file (h5py.File): Open binary UFF file.
+            
+            Returns:
+                    piezoimg (np.array): 2D array containing the piezo image. None if the file does not contain one.
+    """
+    if 'piezoimg' not in h5file:
+        return None
+    return h5file['piezoimg'][()]
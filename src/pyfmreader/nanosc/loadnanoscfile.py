@@ -2,18 +2,32 @@
 # used to load the metadata of NANOSCOPE files.
 
 from .parsenanoscheader import parseNANOSCheader
+from .loadnanosccurve import loadNANOSCforcevolume
+from ..utils.metadatacache import loadmetadatacache, savemetadatacache
 
-def loadNANOSCfile(filepath, UFF):
+def loadNANOSCfile(filepath, UFF, memmap=False, metadata_cache=False):
     """
     Function used to load the metadata of a NANOSCOPE file.
 
             Parameters:
                     filepath (str): File path to the NANOSCOPE file.
                     UFF (uff.UFF): UFF object to load the metadata into.
+                    memmap (bool): If True, memory map the force curves data into UFF.forcevolume.
+                    metadata_cache (bool): If True, load the metadata from the persistent metadata cache
+                                           if available, and save it there otherwise (see utils.metadatacache).
             
             Returns:
                     UFF (uff.UFF): UFF object containing the loaded metadata.
     """
-    UFF.filemetadata = parseNANOSCheader(filepath)
+    state = loadmetadatacache(filepath) if metadata_cache else None
+    if state is not None:
+        UFF.filemetadata = state['filemetadata']
+        UFF.filemetadata['file_path'] = filepath
+    else:
+        UFF.filemetadata = parseNANOSCheader(filepath)
+        if metadata_cache:
+            savemetadatacache(filepath, {'filemetadata': UFF.filemetadata})
     UFF.isFV = bool(UFF.filemetadata['force_volume'])
+    if memmap:
+        UFF.forcevolume = loadNANOSCforcevolume(UFF.filemetadata)
     return UFF
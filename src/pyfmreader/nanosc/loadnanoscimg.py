@@ -1,37 +1,44 @@
 # File containing the function loadNANOSCimg,
 # used to load the piezo image from NANOSCOPE files.
 
-import itertools
-from struct import unpack
 import numpy as np
 
-def loadNANOSCimg(header):
+def loadNANOSCimg(header, afmfile=None):
     """
     Function used to load the piezo image from a NANOSCOPE file.
 
             Parameters:
                     header (dict): Dictionary containing the file metadata.
+                    afmfile (file object): Open binary buffer of the NANOSCOPE file (optional).
+                                           If None, the file is opened and closed by this function.
             
             Returns:
                     piezoimg (np.array): 2D array containing the piezo image.
     """
-    filepath = header['file_path']
-    with open(filepath, 'rb') as afmfile:
-        fvimgoffset = header['FV_ima_offset']
-        shape = [header['FV_nb_sampsline'], header['FV_nb_lines'], 1]
-        temppiezoimg = np.zeros(shape, np.float64)
-        skip = ((header['FV_nb_sampsline'] / header['FDC_nb_sampsline']) - 1) * 2
-        if fvimgoffset != 0:
-            afmfile.seek(fvimgoffset, 0)
-            image_bytes = header['FV_data_length'] // (header['FV_nb_sampsline'] * header['FV_nb_lines'])
-            if image_bytes == 2: fmt = '<h' # short int
-            elif image_bytes == 4: fmt = '<i' # int
-            mult = header['FV_Zsens'] * header['zscan_sens_nmbyV'] / (2. ** (header['byte_per_pixel'] * 8))
+    if afmfile is None:
+        with open(header['file_path'], 'rb') as afmfile:
+            return loadNANOSCimg(header, afmfile)
 
-            for i, j in itertools.product(range(header['FV_nb_lines']), range(header['FV_nb_sampsline'])):
-                data = unpack(fmt, afmfile.read(image_bytes))
-                temppiezoimg[i, j] = data[0] * mult
-                if skip!=0:
-                    afmfile.seek(skip, 1)
+    fvimgoffset = header['FV_ima_offset']
+    nb_lines = header['FV_nb_lines']
+    nb_sampsline = header['FV_nb_sampsline']
+    # The image can have more samples per line than force curves,
+    # only the pixels on the grid of the force curves are kept.
+    if nb_sampsline % header['FDC_nb_sampsline'] != 0:
+        raise ValueError(f"The image samples per line ({nb_sampsline}) are not a multiple of the force curves per line ({header['FDC_nb_sampsline']}).")
+    step = nb_sampsline // header['FDC_nb_sampsline']
+    shape = [nb_lines, nb_sampsline // step, 1]
+    temppiezoimg = np.zeros(shape, np.float64)
+    if fvimgoffset != 0:
+        afmfile.seek(fvimgoffset, 0)
+        image_bytes = header['FV_data_length'] // (nb_sampsline * nb_lines)
+        if image_bytes == 2: dtype = np.dtype('<i2') # short int
+        elif image_bytes == 4: dtype = np.dtype('<i4') # int
+        mult = header['FV_Zsens'] * header['zscan_sens_nmbyV'] / (2. ** (header['byte_per_pixel'] * 8))
 
-        return temppiezoimg - temppiezoimg.min()
\ No newline at end of file
+        # Read the whole image block at once, without reading past its end.
+        imagecontents = afmfile.read(nb_lines * nb_sampsline * image_bytes)
+        data = np.frombuffer(imagecontents, dtype).reshape(nb_lines, nb_sampsline)
+        temppiezoimg[:, :, 0] = data[:, ::step] * mult
+
+    return temppiezoimg - temppiezoimg.min()
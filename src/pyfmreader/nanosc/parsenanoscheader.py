@@ -72,8 +72,9 @@ def parseNANOSCheader(filepath):
     header['Entry_UFF_version'] = UFF_version
     
     with open(filepath, 'rb') as afmfile:
-        headerlines = afmfile.readlines()
-        for rawline in headerlines:
+        # Lines are read one at a time, so the reading stops at
+        # the end of the header and the force data is never read.
+        for rawline in afmfile:
             line = rawline.decode('latin_1')
 
             # End of header flag
@@ -3,14 +3,15 @@
 # AFM data format files.
 
 import os
+import numpy as np
 from .constants import *
 from .jpk.loadjpkfile import loadJPKfile
 from .jpk.loadjpkthermalfile import loadJPKThermalFile
 from .nanosc.loadnanoscfile import loadNANOSCfile
-from .load_uff import loadUFFtxt
+from .load_uff import loadUFFtxt, loadUFFhdf5
 from .uff import UFF
 
-def loadfile(filepath):
+def loadfile(filepath, memmap=False, lazy=False, raw_data='keep', lazy_conversion=False, dtype=np.float64, metadata_cache=False):
     """
     Load AFM file. 
     
@@ -18,10 +19,26 @@ def loadfile(filepath):
         - JPK --> .jpk-force, .jpk-force-map, .jpk-qi-data
         - JPK Thermal --> .tnd
         - NANOSCOPE --> .spm, .pfc, .00X
-        - UFF --> .uff
+        - UFF --> .uff, .uff.h5
 
             Parameters:
                     filepath (str): Path to the file.
+                    memmap (bool): If True, the force curves of NANOSCOPE files are memory mapped
+                                   into UFF.forcevolume and loaded from it.
+                    lazy (bool): If True, the segment headers of JPK force maps and QI files are
+                                 parsed when each curve is first loaded, instead of at open time.
+                    raw_data (str): How the raw data of the loaded JPK curves is kept: 'keep' to store it,
+                                    'drop' to discard it once converted, or 'lazy' to load it again
+                                    from the file when it is accessed. See uff.UFF.raw_data.
+                    lazy_conversion (bool): If True, the channels of the loaded JPK curves are kept as raw integer
+                                            data and converted to physical units when they are first accessed.
+                    dtype (np.dtype): Floating point type of the data of the loaded curves, np.float64 or np.float32.
+                                      Can be changed for a single curve with uff.UFF.getcurve.
+                    metadata_cache (bool): If True, the metadata parsed from JPK and NANOSCOPE files is kept in a
+                                           persistent cache on disk, keyed by the path, size and modification time
+                                           of the file, so opening the file again does not parse its headers.
+                                           The cache directory is set with the PYFMREADER_CACHE_DIR environment
+                                           variable, by default ~/.cache/pyfmreader (see utils.metadatacache).
             
             Returns:
                     If JPK, NANOSCOPE OR UFF:
@@ -38,16 +55,29 @@ def loadfile(filepath):
     # Depending on the configuration of the OS, JPK files have the following
     # extension: .jpk-force.zip
     if split_path[-1] == 'zip': filesuffix = split_path[-2]
+    # Binary UFF files have a double extension: .uff.h5
+    elif os.extsep.join(split_path[-2:]) in uffhdf5files: filesuffix = os.extsep.join(split_path[-2:])
     else: filesuffix = split_path[-1]
 
+    if not np.issubdtype(dtype, np.floating):
+        raise ValueError(f"dtype must be a floating point type, not {dtype!r}")
+    if raw_data not in ('keep', 'drop', 'lazy'):
+        raise ValueError(f"raw_data must be 'keep', 'drop' or 'lazy', not {raw_data!r}")
+
     uffobj = UFF()
+    uffobj.raw_data = raw_data
+    uffobj.lazy_conversion = lazy_conversion
+    uffobj.dtype = np.dtype(dtype)
 
     if filesuffix[1:].isdigit() or filesuffix in nanoscfiles:
-        return loadNANOSCfile(filepath, uffobj)
+        return loadNANOSCfile(filepath, uffobj, memmap, metadata_cache)
 
     elif filesuffix in jpkfiles:
-        return loadJPKfile(filepath, uffobj, filesuffix)
+        return loadJPKfile(filepath, uffobj, filesuffix, lazy, metadata_cache)
     
+    elif filesuffix in uffhdf5files:
+        return loadUFFhdf5(filepath, uffobj)
+
     elif filesuffix in ufffiles:
         return loadUFFtxt(filepath, uffobj)
     
@@ -1,6 +1,10 @@
 import os
+import json
+import numpy as np
 
-def saveUFFtxt(savefile, UFF, savedir, curveidx=0):
+from .load_uff import saveUFFindex, getUFFindexpath
+
+def saveUFFtxt(savefile, UFF, savedir, curveidx=0, writeindex=False):
     """
     Save data and metadata into txt UFF files.
 
@@ -17,21 +21,22 @@ def saveUFFtxt(savefile, UFF, savedir, curveidx=0):
                     UFF (uff.UFF): UFF object containing the data to save.
                     savedir (str): Path to the folder to save the txt UFF files.
                     curveidx (int): Index of the force distance curve to save.
+                    writeindex (bool): If True, save the sidecar index of the file (file_name.uff.idx), see load_uff.saveUFFindex.
             
             Returns: None
     """
     filemetadata = UFF.filemetadata
-    if UFF.isFV:
-        savefile = os.path.join(savedir, filemetadata['Entry_filename'] + f'_{curveidx}' + '.uff')
-    else:
-        savefile = os.path.join(savedir, filemetadata['Entry_filename'] + '.uff')
+    savefile = getUFFtxtpath(UFF, savedir, curveidx)
     FDC = UFF.getcurve(curveidx)
-    with open(savefile, 'w', encoding='utf=8') as f:
+    # Write to a temporary file first, so an interrupted export
+    # never leaves an incomplete file with the final name.
+    tmpfile = savefile + '.part'
+    with open(tmpfile, 'w', encoding='utf=8') as f:
         f.write("HE UFF_code:                        %6s\n" % (filemetadata.get('UFF_code', 0)))
         f.write("HE Entry_UFF_version:               %s\n" % (str(filemetadata.get('Entry_UFF_version', 0))))
         f.write("HE Entry_date:                      %10s\n" % (filemetadata.get('Entry_date', 0)))
         f.write("HE Entry_filename:                  %s\n" % (filemetadata.get('Entry_filename', 0)))
-        f.write("HE Entry_tot_nb_curve:              %d\n" % (filemetadata.get('Entry_tot_nb_curve', 0)))
+        f.write("HE Entry_tot_nb_curve:              %d\n" % (filemetadata.get('source_Entry_tot_nb_curve', filemetadata.get('Entry_tot_nb_curve', 0))))
         # f.write("Entry_version %d\n" % (filemetadata.get('EN.version', 0)))
         # f.write("Entry_txt_byte_len %d\n" % (filemetadata.get('EN.txt_byte_len', 0)))
         f.write("HE Author_name:                     %s\n" % (filemetadata.get('Author_name', 0)))
@@ -69,11 +74,33 @@ def saveUFFtxt(savefile, UFF, savedir, curveidx=0):
         f.write("HE Recording_zpiezo_sens(m/V):      %E\n" % (filemetadata.get('Recording_zpiezo_sens(m/V)', 0)))
         f.write("HE Recording_inv_optical_lever_sens_read(m/V): %E\n" % (filemetadata.get('Recording_inv_optical_lever_sens_read(m/V)', 0)))
         f.write("HE Recording_inv_optical_lever_sens_used(m/V): %E\n" % (filemetadata.get('Recording_inv_optical_lever_sens_used(m/V)', 0)))
-        f.write("HE Recording_number_segment:        %d\n" % (filemetadata.get('Recording_number_segment', 0)))
+        f.write("HE Recording_number_segment:        %d\n" % (filemetadata.get('Recording_number_segment', len(FDC.get_segments()))))
         f.write("HE Recording_Z_close_loop_on:       %s\n" % (filemetadata.get('Recording_Z_close_loop_on', 0)))
         f.write("HE Recording_XY_close_loop_on:      %s\n" % (filemetadata.get('Recording_XY_close_loop_on', 0)))
         writeUFFsegment(f, FDC)
-        
+    os.replace(tmpfile, savefile)
+    if writeindex:
+        saveUFFindex(savefile)
+    elif os.path.exists(getUFFindexpath(savefile)):
+        # Remove the index of a previous export of the file.
+        os.remove(getUFFindexpath(savefile))
+
+def getUFFtxtpath(UFF, savedir, curveidx=0):
+    """
+    Get the path of the txt UFF file used to save a force curve, see saveUFFtxt.
+
+            Parameters:
+                    UFF (uff.UFF): UFF object containing the data to save.
+                    savedir (str): Path to the folder to save the txt UFF files.
+                    curveidx (int): Index of the force distance curve to save.
+            
+            Returns:
+                    savefile (str): Path to the txt UFF file.
+    """
+    filename = UFF.filemetadata['Entry_filename']
+    if UFF.isFV:
+        return os.path.join(savedir, filename + f'_{curveidx}' + '.uff')
+    return os.path.join(savedir, filename + '.uff')
 
 def writeUFFsegment(f, FDC):
     """
@@ -86,6 +113,9 @@ def writeUFFsegment(f, FDC):
             Returns: None
     """
     for segid, segment in FDC.get_segments():
+        # Get the column names and data once per segment
+        colkeys = list(segment.segment_formated_data.keys())
+        colvalues = list(segment.segment_formated_data.values())
         # Write segment header
         f.write("HE Recording_segment_%d_type:      %s\n" % (int(segid), segment.segment_type))
         f.write("HE Recording_segment_%d_code:      %s\n" % (int(segid), segment.segment_code))
@@ -95,18 +125,217 @@ def writeUFFsegment(f, FDC):
         f.write("HE Recording_segment_%d_nb_point:  %d \n" % (int(segid), segment.nb_point))
         f.write("HE Recording_segment_%d_nb_col:    %d \n" % (int(segid), segment.nb_col))
         for colidx in range(segment.nb_col):
-            f.write("HE Recording_segment_%d_col_%d_title: %s \n" % (int(segid), colidx, list(segment.segment_formated_data.keys())[colidx]))
-            f.write("HE Recording_segment_%d_col_%d_unit:  %s \n" % (int(segid), colidx, list(segment.segment_formated_data.keys())[colidx]))
+            f.write("HE Recording_segment_%d_col_%d_title: %s \n" % (int(segid), colidx, colkeys[colidx]))
+            f.write("HE Recording_segment_%d_col_%d_unit:  %s \n" % (int(segid), colidx, colkeys[colidx]))
         f.write("HE Recording_segment_%d_sampling_rate(Hz): %E \n" % (int(segid), segment.sampling_rate))
         f.write("HE Recording_segment_%d_velocity(m/s): %E \n" % (int(segid), segment.velocity))
         f.write("HE Recording_segment_%d_force_setpoint(N): %E \n" % (int(segid), segment.force_setpoint))
         f.write("HE Recording_segment_%d_z_displacement(m): %E \n" % (int(segid), segment.z_displacement))
         # Write segment data
-        for j in range(segment.nb_point):
-            ndat = "%s %5d " % (segment.segment_code, int(segid))
-            for k in range(segment.nb_col):
-                ndat = ndat + "%15E " % (list(segment.segment_formated_data.values())[k][j])
-            f.write(ndat + "\n")
-
-def saveUFFhdf5():
-    pass
\ No newline at end of file
+        writeUFFsegmentdata(f, segment, int(segid), colvalues)
+
+def writeUFFsegmentdata(f, segment, segid, colvalues, blocksize=4096):
+    """
+    Write the data lines of a segment to the UFF text file.
+
+    The data is formatted in blocks of lines, using a single format
+    operation per block instead of one per value.
+
+            Parameters:
+                    f (file object): txt file to write into.
+                    segment (utils.segment.Segment): Segment containing the data to save.
+                    segid (int): Segment number.
+                    colvalues (list): Data arrays of the segment columns.
+                    blocksize (int): Number of lines formatted at once.
+            
+            Returns: None
+    """
+    nb_point, nb_col = segment.nb_point, segment.nb_col
+    if nb_col:
+        for colidx in range(nb_col):
+            if len(colvalues[colidx]) < nb_point:
+                raise IndexError(f"Segment {segid} column {colidx} has less than {nb_point} points.")
+        segdata = np.column_stack([np.asarray(colvalues[colidx][:nb_point], dtype=np.float64) for colidx in range(nb_col)])
+    else:
+        segdata = np.empty((nb_point, 0))
+    # Escape the segment code, it becomes part of the format string.
+    linefmt = ("%s %5d " % (segment.segment_code, segid)).replace("%", "%%") + "%15E " * nb_col + "\n"
+    for start in range(0, nb_point, blocksize):
+        block = segdata[start:start + blocksize]
+        f.write((linefmt * len(block)) % tuple(block.ravel().tolist()))
+
+def _jsondefault(value):
+    """
+    Helper function used to serialize numpy values into JSON.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+def saveUFFhdf5(UFF, savefile, compression='gzip', compression_opts=None, chunksize=65536, batchsize=256):
+    """
+    Save data and metadata into a binary UFF file, using the HDF5 format.
+
+    All the force curves of the file are saved into a single HDF5 file. Curves are
+    streamed from the UFF object and written in batches, so the whole force volume
+    is never held in memory.
+
+    The HDF5 file is structured as follows:
+
+        / (attrs)                                   File metadata. The full metadata is stored as JSON in the filemetadata attribute.
+        /piezoimg                                   Piezo image (only Force Volume files).
+        /imagedata/{channel}                        Additional image data (only if present).
+        /segments/{segment_id} (attrs)              segment_type, segment_code, description, force_setpoint_mode and columns.
+        /segments/{segment_id}/offsets              Position of each curve in the data arrays (Entry_tot_nb_curve + 1).
+        /segments/{segment_id}/data/{column}        Data of all the curves for each column, concatenated.
+        /segments/{segment_id}/{field}              velocity, sampling_rate, z_displacement and force_setpoint of each curve.
+        /segments/{segment_id}/metadata             Segment metadata of each curve, as JSON.
+
+    The data of segment S of curve i is: data[column][offsets[i]:offsets[i+1]]
+
+    Requires the h5py package.
+
+            Parameters:
+                    UFF (uff.UFF): UFF object containing the data to save.
+                    savefile (str): Path to the HDF5 file, normally with extension .uff.h5
+                    compression (str): Compression filter for the data arrays ('gzip', 'lzf' or None).
+                    compression_opts (int): Compression level, only for 'gzip'.
+                    chunksize (int): Number of values per chunk of the data arrays.
+                    batchsize (int): Number of curves kept in memory before writing them.
+            
+            Returns: None
+    """
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("The h5py package is required to save UFF files in HDF5 format.")
+
+    filemetadata = UFF.filemetadata
+    h5opts = {'compression': compression, 'compression_opts': compression_opts, 'chunksize': chunksize}
+
+    with h5py.File(savefile, 'w') as f:
+        # Write file metadata.
+        metadata = {key: value for key, value in filemetadata.items() if key != 'curve_properties'}
+        f.attrs['filemetadata'] = json.dumps(metadata, default=_jsondefault)
+        for key, value in metadata.items():
+            if isinstance(value, (str, bool, int, float, np.number)):
+                f.attrs[key] = value
+
+        # Write the curves data.
+        segments = f.create_group('segments')
+        if UFF.isFV:
+            FDCs = UFF.stream_curves()
+        else:
+            FDCs = UFF.iter_curves([0])
+        batch = []
+        for FDC in FDCs:
+            batch.append(FDC)
+            if len(batch) == batchsize:
+                writeUFFhdf5batch(segments, batch, h5opts)
+                batch = []
+        writeUFFhdf5batch(segments, batch, h5opts)
+
+        # Write image data.
+        if UFF.isFV:
+            f.create_dataset('piezoimg', data=np.asarray(UFF.getpiezoimg()))
+        if UFF.imagedata:
+            imagedata = f.create_group('imagedata')
+            for channel, image in UFF.imagedata.items():
+                imagedata.create_dataset(channel, data=image)
+
+def writeUFFhdf5batch(segments, batch, h5opts):
+    """
+    Append a batch of force curves to the segments group of a binary UFF file.
+
+            Parameters:
+                    segments (h5py.Group): Group containing the segments of the file.
+                    batch (list): List of utils.forcecurve.ForceCurve objects to append.
+                    h5opts (dict): Dictionary containing the compression, compression_opts and chunksize options.
+            
+            Returns: None
+    """
+    if not batch:
+        return
+    import h5py
+
+    first_curve = segments.attrs.get('nb_curves', 0) == 0
+    nb_curves = segments.attrs.get('nb_curves', 0) + len(batch)
+    batch_segments = [{str(int(segid)): segment for segid, segment in FDC.get_segments()} for FDC in batch]
+
+    if first_curve:
+        for segid, segment in batch_segments[0].items():
+            group = segments.create_group(segid)
+            group.attrs['segment_type'] = str(segment.segment_type)
+            group.attrs['segment_code'] = str(segment.segment_code)
+            group.attrs['description'] = str(segment.description)
+            group.attrs['force_setpoint_mode'] = str(segment.force_setpoint_mode)
+            group.attrs['columns'] = list(segment.segment_formated_data.keys())
+            group.create_dataset('offsets', data=np.zeros(1, np.int64), maxshape=(None,), chunks=True)
+            data = group.create_group('data')
+            for column, values in segment.segment_formated_data.items():
+                data.create_dataset(
+                    column, shape=(0,), dtype=np.asarray(values).dtype, maxshape=(None,),
+                    chunks=(h5opts['chunksize'],), compression=h5opts['compression'],
+                    compression_opts=h5opts['compression_opts'], shuffle=h5opts['compression'] is not None
+                )
+            for field in ('velocity', 'sampling_rate', 'z_displacement', 'force_setpoint'):
+                group.create_dataset(field, shape=(0,), dtype=np.float64, maxshape=(None,), chunks=True)
+            group.create_dataset('metadata', shape=(0,), dtype=h5py.string_dtype(), maxshape=(None,), chunks=True)
+
+    for FDC_segments in batch_segments:
+        for segid in FDC_segments:
+            if segid not in segments:
+                raise ValueError(f"Segment {segid} is not present in the first curve, all the curves must have the same segments.")
+
+    for segid, group in segments.items():
+        columns = list(group.attrs['columns'])
+        values = {column: [] for column in columns}
+        lengths = []
+        fields = {field: [] for field in ('velocity', 'sampling_rate', 'z_displacement', 'force_setpoint')}
+        metadata = []
+        for FDC_segments in batch_segments:
+            segment = FDC_segments.get(segid)
+            # Missing segments are saved with length 0.
+            if segment is None:
+                lengths.append(0)
+                for field in fields: fields[field].append(np.nan)
+                metadata.append('')
+                continue
+            if list(segment.segment_formated_data.keys()) != columns:
+                raise ValueError(f"All the curves must have the same columns in segment {segid}.")
+            length = len(segment.segment_formated_data[columns[0]])
+            for column in columns:
+                if len(segment.segment_formated_data[column]) != length:
+                    raise ValueError(f"All the columns of segment {segid} must have the same length.")
+                values[column].append(np.asarray(segment.segment_formated_data[column]))
+            lengths.append(length)
+            for field in fields:
+                value = getattr(segment, field)
+                fields[field].append(np.nan if value is None else value)
+            metadata.append(json.dumps(segment.segment_metadata, default=_jsondefault) if segment.segment_metadata is not None else '')
+
+        # Append offsets
+        offsets = group['offsets']
+        start = offsets[-1]
+        newoffsets = start + np.cumsum(lengths)
+        offsets.resize((offsets.shape[0] + len(lengths),))
+        offsets[-len(lengths):] = newoffsets
+        # Append data
+        for column in columns:
+            dataset = group['data'][column]
+            if values[column]:
+                columndata = np.concatenate(values[column])
+                dataset.resize((start + len(columndata),))
+                dataset[start:] = columndata
+        # Append per curve fields
+        for field, fieldvalues in fields.items():
+            dataset = group[field]
+            dataset.resize((nb_curves,))
+            dataset[-len(fieldvalues):] = fieldvalues
+        dataset = group['metadata']
+        dataset.resize((nb_curves,))
+        dataset[-len(metadata):] = metadata
+
+    segments.attrs['nb_curves'] = nb_curves
\ No newline at end of file
@@ -1,132 +1,605 @@
 # File containing the UFF class.
 # Used to store data and metadata.
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import Pool
+import os
+import threading
 from zipfile import ZipFile
 
+import numpy as np
+
 from .constants import *
 from .jpk.loadjpkcurve import loadJPKcurve
+from .jpk.loadjpkfile import loadJPKcurveproperties
 from .jpk.loadjpkimg import computeJPKPiezoImg
-from .nanosc.loadnanosccurve import loadNANOSCcurve
+from .nanosc.loadnanosccurve import loadNANOSCcurve, loadNANOSCforcevolume
 from .nanosc.loadnanoscimg import loadNANOSCimg
-from .load_uff import loadUFFcurve
-from .save_uff import saveUFFtxt
+from .load_uff import loadUFFcurve, loadUFFhdf5curve, loadUFFhdf5img
+from .save_uff import saveUFFtxt, saveUFFhdf5, getUFFtxtpath
+from .utils.curvecache import CurveCache
+from .utils.forcemap import ForceMap
 
 class UFF:
     """
     Class used to store the data and metadata of an AFM file.
 
+    It can be used as a context manager to keep the AFM file open
+    while several operations are performed on it:
+
+        with loadfile(filepath) as uff:
+            FC = uff.getcurve(0)
+
             Properties:
                     filemetadata (dict): Dictionary containing the file metadata.
                     isFV (bool): Flag indicating if the file is a Force Volume or not.
                     piezoimg (np.array): 2D np.array containing the piezo image of the file.
+                    forcevolume (np.memmap): Memory mapped force curves data (optional, only NANOSCOPE files).
                     imagedata (dict): dictionary containing additional image data.
+                    raw_data (str): How the raw data of the loaded curves is kept ('keep', 'drop' or 'lazy'),
+                                    see jpk.loadjpkcurve.loadJPKcurve. Only JPK files store raw data.
+                    lazy_conversion (bool): If True, the channels of the loaded JPK curves are converted
+                                            when they are first accessed, see jpk.loadjpkcurve.loadJPKcurve.
+                    dtype (np.dtype): Floating point type of the data of the loaded curves (np.float64 or np.float32).
             
             Methods:
+                    open
+                    close
                     getcurve
+                    getcurves
+                    iter_curves
+                    stream_curves
+                    map_curves
+                    set_cache
+                    cache_info
                     getpiezoimg
                     to_txt
+                    to_hdf5
 
     """
     def __init__(self):
         self.filemetadata=None
         # JPK Specific Atributes
         self._sharedataprops=None
-        self._groupedpaths=None
+        self._zipindex=None
         # FV Specific Atribtues
         self.isFV=None
         self.piezoimg=None
+        self.forcevolume=None
         # In files like JPK scans you may
         # have additional image data.
         self.imagedata=None
+        # Raw data of loaded curves (only JPK files).
+        self.raw_data='keep'
+        self.lazy_conversion=False
+        self.dtype=np.dtype(np.float64)
+        # Open file buffers, only set while the
+        # file is kept open (see UFF.open).
+        self._file=None
+        self._afmfile=None
+        # Optional cache of loaded curves (see UFF.set_cache).
+        self._curvecache=None
+
+    def __getstate__(self):
+        # Open buffers can not be pickled, and memory mapped
+        # data is mapped again when the object is unpickled.
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_afmfile'] = None
+        state['_curvecache'] = None
+        state['forcevolume'] = None
+        state['_remapforcevolume'] = self.forcevolume is not None
+        return state
+
+    def __setstate__(self, state):
+        remapforcevolume = state.pop('_remapforcevolume', False)
+        self.__dict__.update(state)
+        if remapforcevolume:
+            self.forcevolume = loadNANOSCforcevolume(self.filemetadata)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """
+        Function used to open the AFM file and keep it open until UFF.close is called.
+
+        While the file is open, all the functions loading data from it reuse the same buffer.
+        
+        Supported formats:
+            - JPK --> .jpk-force, .jpk-force-map, .jpk-qi-data
+            - NANOSCOPE --> .spm, .pfc
+            - UFF --> .uff, .uff.h5
+
+                Parameters: None
+                
+                Returns:
+                        UFF (uff.UFF): The UFF object itself.
+        """
+        if self._afmfile is not None:
+            return self
+        file_type = self.filemetadata['file_type']
+        self._file = self._openfile()
+        if file_type in jpkfiles:
+            self._afmfile = ZipFile(self._file)
+        else:
+            self._afmfile = self._file
+        return self
+
+    def close(self):
+        """
+        Function used to close the AFM file opened with UFF.open.
+
+                Parameters: None
+                
+                Returns: None
+        """
+        if self._afmfile is not None and self._afmfile is not self._file:
+            self._afmfile.close()
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._afmfile = None
+
+    def _openfile(self):
+        """
+        Hidden function used to open a new buffer of the AFM file.
+
+                Returns:
+                        file (file object): Text buffer for UFF files, h5py.File for binary UFF files, binary buffer otherwise.
+        """
+        if self.filemetadata['file_type'] in uffhdf5files:
+            import h5py
+            return h5py.File(self.filemetadata['file_path'], 'r')
+        if self.filemetadata['file_type'] in ufffiles:
+            return open(self.filemetadata['file_path'], 'r')
+        return open(self.filemetadata['file_path'], 'rb')
+
+    @contextmanager
+    def _keepopen(self):
+        """
+        Hidden context manager used to get the buffer of the AFM file.
+
+        If the file is already open it is reused, otherwise it is
+        opened and closed again when the block exits.
+
+                Yields:
+                        afmfile (ZipFile or file object): Buffer containing the data of the AFM file.
+        """
+        if self._afmfile is not None:
+            yield self._afmfile
+            return
+        self.open()
+        try:
+            yield self._afmfile
+        finally:
+            self.close()
     
-    def _loadcurve(self, curveidx, afmfile, file_type):
+    def _loadcurve(self, curveidx, afmfile, file_type, dtype=None):
         """
         Hidden function used to load a single curve from a file.
         
         Supported formats:
             - JPK --> .jpk-force, .jpk-force-map, .jpk-qi-data
             - NANOSCOPE --> .spm, .pfc
-            - UFF --> .uff
+            - UFF --> .uff, .uff.h5
 
                 Parameters:
                         curveidx (int): Index of curve to load.
-                        afmfile (ZipFile): Buffer containing the data of the AFM file. Only used for JPK files.
+                        afmfile (ZipFile or file object): Buffer containing the data of the AFM file.
                         file_type (str): File extension.
+                        dtype (np.dtype): Floating point type of the curve data. If None, UFF.dtype is used.
                 
                 Returns:
                         FC (utils.forcecurve.ForceCurve): ForceCurve object containing the force curve data.
         """
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        # The same curve can be cached once per data type.
+        cachekey = (curveidx, dtype.str)
+        if self._curvecache is not None:
+            FC = self._curvecache.get(cachekey)
+            if FC is not None:
+                return FC
         if file_type in jpkfiles:
-            curvepaths = self._groupedpaths[curveidx]
+            # Segment headers not parsed yet when the file was loaded in lazy mode.
+            if str(curveidx) not in self.filemetadata['curve_properties']:
+                loadJPKcurveproperties(afmfile, self, curveidx)
             FC = loadJPKcurve(
-                curvepaths, afmfile, curveidx, self.filemetadata
+                self._zipindex[curveidx], afmfile, curveidx, self.filemetadata,
+                self.raw_data, self.lazy_conversion, dtype
             )
         elif file_type[1:].isdigit() or file_type in nanoscfiles:
-            FC = loadNANOSCcurve(curveidx, self.filemetadata)
+            FC = loadNANOSCcurve(curveidx, self.filemetadata, afmfile, self.forcevolume, dtype)
+        elif file_type in uffhdf5files:
+            FC = loadUFFhdf5curve(curveidx, self.filemetadata, afmfile, dtype)
         elif file_type in ufffiles:
-            FC = loadUFFcurve(self.filemetadata)
+            # A txt UFF file contains a single curve, its index can be 0 or its id in the source file.
+            curve_id = int(self.filemetadata['Recording_curve_id'])
+            if curveidx not in (0, curve_id):
+                raise IndexError(f"Curve {curveidx} is not in {self.filemetadata['file_path']}, it only contains curve {curve_id}.")
+            FC = loadUFFcurve(self.filemetadata, afmfile, dtype=dtype)
+        if self._curvecache is not None:
+            self._curvecache.put(cachekey, FC)
         return FC
 
-    def getcurve(self, curveidx):
+    def getcurve(self, curveidx, dtype=None):
         """
         Function used to load a single curve from a file.
         
         Supported formats:
             - JPK --> .jpk-force, .jpk-force-map, .jpk-qi-data
             - NANOSCOPE --> .spm, .pfc
-            - UFF --> .uff
+            - UFF --> .uff, .uff.h5
 
                 Parameters:
                         curveidx (int): Index of curve to load.
+                        dtype (np.dtype): Floating point type of the curve data (np.float64 or np.float32).
+                                          If None, UFF.dtype is used, see pyfmreader.loadfile.
                 
                 Returns:
                         FC (utils.forcecurve.ForceCurve): ForceCurve object containing the force curve data.
         """
         file_type = self.filemetadata['file_type']
-        if file_type in jpkfiles:
-            with open(self.filemetadata['file_path'], 'rb') as file:
-                afmfile = ZipFile(file)
-                FC = self._loadcurve(curveidx, afmfile, file_type)
-        elif file_type[1:].isdigit() or file_type in nanoscfiles:
-            FC = self._loadcurve(curveidx, None, file_type)
-        elif file_type in ufffiles:
-            FC = self._loadcurve(None, None, file_type)
+        with self._keepopen() as afmfile:
+            FC = self._loadcurve(curveidx, afmfile, file_type, dtype)
         return FC
+
+    def iter_curves(self, indices=None, prefetch=0, threads=None):
+        """
+        Generator used to load several curves from a file, one at a time.
+
+        The file (and for JPK files its ZipFile buffer) is opened only once
+        and shared by all the curves loaded.
+
+        If prefetch is greater than 0, the next curves are read, decompressed and
+        decoded in background threads while the current curve is being used.
+        At most prefetch curves are loaded ahead of the one yielded.
+        
+        Supported formats:
+            - JPK --> .jpk-force, .jpk-force-map, .jpk-qi-data
+            - NANOSCOPE --> .spm, .pfc
+            - UFF --> .uff, .uff.h5
+
+                Parameters:
+                        indices (iterable): Indices of the curves to load. If None, all the curves are loaded.
+                        prefetch (int): Number of curves to load ahead in background threads. If 0, curves are loaded synchronously.
+                        threads (int): Number of background threads. If None, prefetch threads are used.
+                
+                Yields:
+                        FC (utils.forcecurve.ForceCurve): ForceCurve object containing the force curve data.
+        """
+        if indices is None:
+            indices = range(self.filemetadata['Entry_tot_nb_curve'])
+        file_type = self.filemetadata['file_type']
+        with self._keepopen() as afmfile:
+            if prefetch <= 0:
+                for curveidx in indices:
+                    yield self._loadcurve(curveidx, afmfile, file_type)
+                return
+
+            # Reading ZipFile members from several threads is safe. Other file
+            # buffers share their position, so each thread opens its own.
+            threadbuffers = threading.local()
+            openedbuffers = []
+            def loadcurve(curveidx):
+                if file_type in jpkfiles:
+                    return self._loadcurve(curveidx, afmfile, file_type)
+                if not hasattr(threadbuffers, 'afmfile'):
+                    threadbuffers.afmfile = self._openfile()
+                    openedbuffers.append(threadbuffers.afmfile)
+                return self._loadcurve(curveidx, threadbuffers.afmfile, file_type)
+
+            try:
+                with ThreadPoolExecutor(threads or prefetch) as executor:
+                    futures = deque()
+                    for curveidx in indices:
+                        futures.append(executor.submit(loadcurve, curveidx))
+                        if len(futures) > prefetch:
+                            yield futures.popleft().result()
+                    while futures:
+                        yield futures.popleft().result()
+            finally:
+                for buffer in openedbuffers:
+                    buffer.close()
+
+    def getcurves(self, indices=None):
+        """
+        Function used to load several curves from a file.
+
+        The file (and for JPK files its ZipFile buffer) is opened only once
+        and shared by all the curves loaded.
+        
+        Supported formats:
+            - JPK --> .jpk-force, .jpk-force-map, .jpk-qi-data
+            - NANOSCOPE --> .spm, .pfc
+            - UFF --> .uff, .uff.h5
+
+                Parameters:
+                        indices (iterable): Indices of the curves to load. If None, all the curves are loaded.
+                
+                Returns:
+                        FCs (list): List of utils.forcecurve.ForceCurve objects, in the same order as indices.
+        """
+        return list(self.iter_curves(indices))
+
+    def stream_curves(self, prefetch=0, threads=None):
+        """
+        Generator used to traverse all the curves of a file with bounded memory.
+
+        Curves are yielded one at a time, in index order. The memory used by this
+        function does not grow with the number of curves in the file: at most
+        prefetch + 1 curves are held at once, and the segment metadata parsed on
+        the fly for files loaded in lazy mode is discarded after each curve.
+        Curves kept by the caller are not released, so to keep memory constant
+        the caller should not accumulate them.
+        
+        Supported formats:
+            - JPK --> .jpk-force, .jpk-force-map, .jpk-qi-data
+            - NANOSCOPE --> .spm, .pfc
+            - UFF --> .uff, .uff.h5
+
+                Parameters:
+                        prefetch (int): Number of curves to load ahead in background threads, see UFF.iter_curves.
+                        threads (int): Number of background threads, see UFF.iter_curves.
+                
+                Yields:
+                        FC (utils.forcecurve.ForceCurve): ForceCurve object containing the force curve data.
+        """
+        curve_properties = self.filemetadata.get('curve_properties')
+        # Curves whose segment metadata was already loaded before streaming.
+        preloaded = set(curve_properties.keys()) if curve_properties is not None else set()
+        for FC in self.iter_curves(None, prefetch, threads):
+            yield FC
+            curve_id = str(FC.curve_index)
+            if curve_properties is not None and curve_id not in preloaded:
+                curve_properties.pop(curve_id, None)
+
+    def map_curves(self, func=None, indices=None, processes=None, chunksize=None):
+        """
+        Function used to load, and optionally process, several curves using a pool of worker processes.
+
+        Each worker receives a copy of the UFF object once, keeps the AFM file open
+        and loads the curves with UFF._loadcurve. If func is given, it is applied to
+        each curve in the worker and only its result is sent back.
+
+        The function func must be picklable, i.e. defined at the top level of a module.
+        
+        Supported formats:
+            - JPK --> .jpk-force, .jpk-force-map, .jpk-qi-data
+            - NANOSCOPE --> .spm, .pfc
+            - UFF --> .uff, .uff.h5
+
+                Parameters:
+                        func (callable): Function applied to each utils.forcecurve.ForceCurve (optional).
+                        indices (iterable): Indices of the curves to load. If None, all the curves are loaded.
+                        processes (int): Number of worker processes. If None, the number of CPUs is used.
+                        chunksize (int): Number of curves sent to a worker at once. If None, it is computed automatically.
+                
+                Returns:
+                        results (list): Loaded curves, or the results of func, in the same order as indices.
+        """
+        if indices is None:
+            indices = range(self.filemetadata['Entry_tot_nb_curve'])
+        with Pool(processes, _initworker, (self, func)) as pool:
+            return pool.map(_loadworkercurve, indices, chunksize)
     
-    def getpiezoimg(self):
+    def set_cache(self, maxbytes):
+        """
+        Function used to enable a cache of the loaded curves, keyed by curve index and data type.
+
+        Once the cache is full, the least recently used curves are evicted.
+        Cached curves are returned as the same ForceCurve objects, so changes
+        made to them (i.e: preprocessing) are kept between calls and count
+        towards maxbytes. Worker processes of UFF.map_curves and UFF.to_txt
+        do not use the cache.
+
+                Parameters:
+                        maxbytes (int): Maximum size of the cached curve data, in bytes. If None or 0, the cache is disabled.
+                
+                Returns: None
+        """
+        if maxbytes:
+            self._curvecache = CurveCache(maxbytes)
+        else:
+            self._curvecache = None
+
+    def cache_info(self):
+        """
+        Function used to get the statistics of the cache of loaded curves.
+
+                Parameters: None
+                
+                Returns:
+                        info (dict): Dictionary with the hits, misses, number of curves, current and maximum size in bytes.
+                                     None if the cache is disabled.
+        """
+        if self._curvecache is None:
+            return None
+        return self._curvecache.info()
+
+    def getforcemap(self, indices=None, prefetch=0, threads=None, ragged=False):
+        """
+        Function used to load several curves into a single utils.forcemap.ForceMap,
+        which stores the data of all the curves as stacked arrays.
+
+        The curves are loaded one at a time and released once their data is copied
+        into the arrays of the map, which are preallocated from the number of curves
+        and the number of points of the first curve, see UFF.stream_curves.
+        
+        Supported formats:
+            - JPK --> .jpk-force, .jpk-force-map, .jpk-qi-data
+            - NANOSCOPE --> .spm, .pfc
+            - UFF --> .uff, .uff.h5
+
+                Parameters:
+                        indices (iterable): Indices of the curves to load. If None, all the curves are loaded.
+                        prefetch (int): Number of curves to load ahead in background threads, see UFF.iter_curves.
+                        threads (int): Number of background threads, see UFF.iter_curves.
+                        ragged (bool): If True, store the data as utils.raggedarray.RaggedArray instead of padded arrays.
+                
+                Returns:
+                        FM (utils.forcemap.ForceMap): ForceMap object containing the data of the curves.
+        """
+        if indices is None:
+            nb_curves = self.filemetadata['Entry_tot_nb_curve']
+            FCs = self.stream_curves(prefetch, threads)
+        else:
+            nb_curves = len(indices) if hasattr(indices, '__len__') else None
+            FCs = self.iter_curves(indices, prefetch, threads)
+        return ForceMap.from_curves(FCs, ragged=ragged, nb_curves=nb_curves)
+
+    def getpiezoimg(self, use_imagedata=True):
         """
         Function used to compute the piezo image of a file.
 
         It is required that the file is a Force Volume.
+
+        For JPK files, the height image recorded by the instrument is used by default,
+        which is not the last approach value of each curve, see jpk.loadjpkimg.computeJPKPiezoImg.
         
         Supported formats:
             - JPK --> .jpk-force-map, .jpk-qi-data
             - NANOSCOPE --> .spm, .pfc
+            - UFF --> .uff.h5
 
-                Parameters: None
+                Parameters:
+                        use_imagedata (bool): If False, the JPK piezo image is computed from the last
+                                              value of the first approach segment of each curve.
                 
                 Returns:
                         piezoimg (np.array): 2D array containing the piezo image of the file.
         """
         file_type = self.filemetadata['file_type']
-        if file_type in jpkfiles:
-            self.piezoimg = computeJPKPiezoImg(self)
-        elif file_type[1:].isdigit() or file_type in nanoscfiles:
-            self.piezoimg = loadNANOSCimg(self.filemetadata)
+        with self._keepopen() as afmfile:
+            if file_type in jpkfiles:
+                self.piezoimg = computeJPKPiezoImg(self, afmfile, use_imagedata)
+            elif file_type[1:].isdigit() or file_type in nanoscfiles:
+                self.piezoimg = loadNANOSCimg(self.filemetadata, afmfile)
+            elif file_type in uffhdf5files:
+                self.piezoimg = loadUFFhdf5img(afmfile)
         return self.piezoimg
     
-    def to_txt(self, savedir):
+    def to_txt(self, savedir, processes=1, progress=None, resume=False, chunksize=None, writeindex=False):
         """
         Function used to save the loaded data into a txt file following the UFF.
 
+        For Force Volume files, every curve is saved into its own file, see save_uff.saveUFFtxt.
+        The curves can be saved by a pool of worker processes, as in UFF.map_curves.
+        Each file is written under a temporary name and renamed once complete, so with
+        resume the curves whose file already exists are skipped and an interrupted
+        export can be restarted.
+
                 Parameters:
                         savedir (str): Path to save the txt UFF file.
+                        processes (int): Number of worker processes. If 1, the curves are saved
+                                         in this process. If None, the number of CPUs is used.
+                        progress (callable): Function called as progress(done, total) after each saved curve, and once
+                                             before saving if curves were skipped with resume (optional).
+                        resume (bool): If True, skip the curves whose txt UFF file already exists.
+                        chunksize (int): Number of curves sent to a worker at once. If None, it is computed automatically.
+                        writeindex (bool): If True, save the sidecar index of each txt UFF file, see load_uff.saveUFFindex.
                 
                 Returns: None
         """
         if self.isFV:
-            for curveidx in range(self.filemetadata['Entry_tot_nb_curve']):
-                saveUFFtxt(self, self, savedir, curveidx)
+            indices = range(self.filemetadata['Entry_tot_nb_curve'])
         else:
-            saveUFFtxt(self, self, savedir)
-        
+            indices = [0]
+        total = len(indices)
+        if resume:
+            indices = [idx for idx in indices if not os.path.exists(getUFFtxtpath(self, savedir, idx))]
+        done = total - len(indices)
+        # Report the skipped curves, even if there are no curves left to save.
+        if done and progress is not None: progress(done, total)
+        if processes == 1 or len(indices) <= 1:
+            with self._keepopen():
+                for curveidx in indices:
+                    saveUFFtxt(self, self, savedir, curveidx, writeindex)
+                    done += 1
+                    if progress is not None: progress(done, total)
+        else:
+            if chunksize is None:
+                # Same heuristic as Pool.map, keeps progress reports frequent.
+                chunksize = max(1, -(-len(indices) // (4 * (processes or os.cpu_count() or 1))))
+            with Pool(processes, _initworker, (self, None)) as pool:
+                tasks = [(curveidx, savedir, writeindex) for curveidx in indices]
+                for _ in pool.imap_unordered(_saveworkercurve, tasks, chunksize):
+                    done += 1
+                    if progress is not None: progress(done, total)
+
+    def to_hdf5(self, savefile, compression='gzip', compression_opts=None, chunksize=65536, batchsize=256):
+        """
+        Function used to save the loaded data into a single binary UFF file, using the HDF5 format.
+
+        See save_uff.saveUFFhdf5 for the structure of the file. Requires the h5py package.
+
+                Parameters:
+                        savefile (str): Path to the HDF5 file, normally with extension .uff.h5
+                        compression (str): Compression filter for the data arrays ('gzip', 'lzf' or None).
+                        compression_opts (int): Compression level, only for 'gzip'.
+                        chunksize (int): Number of values per chunk of the data arrays.
+                        batchsize (int): Number of curves kept in memory before writing them.
+                
+                Returns: None
+        """
+        with self._keepopen():
+            saveUFFhdf5(self, savefile, compression, compression_opts, chunksize, batchsize)
+
+# Worker process state used by UFF.map_curves.
+_workeruff = None
+_workerfunc = None
+
+def _initworker(uff, func):
+    """
+    Hidden function used to initialize the worker processes of UFF.map_curves.
+
+            Parameters:
+                    uff (uff.UFF): Copy of the UFF object used to load the curves.
+                    func (callable): Function applied to each loaded curve (optional).
+            
+            Returns: None
+    """
+    global _workeruff, _workerfunc
+    # Buffers inherited from the parent process share their file
+    # position with it, so each worker opens its own.
+    uff._file = None
+    uff._afmfile = None
+    # With fork the cache is inherited, each worker
+    # would fill its own copy of it.
+    uff._curvecache = None
+    _workeruff = uff.open()
+    _workerfunc = func
+
+def _loadworkercurve(curveidx):
+    """
+    Hidden function used by the worker processes of UFF.map_curves to load a single curve.
+
+            Parameters:
+                    curveidx (int): Index of curve to load.
+            
+            Returns:
+                    FC (utils.forcecurve.ForceCurve): ForceCurve object, or the result of func applied to it.
+    """
+    FC = _workeruff.getcurve(curveidx)
+    if _workerfunc is None:
+        return FC
+    return _workerfunc(FC)
+
+def _saveworkercurve(task):
+    """
+    Hidden function used by the worker processes of UFF.to_txt to save a single curve.
+
+            Parameters:
+                    task (tuple): Index of the curve to save, path of the folder to save it and whether to save its index.
+            
+            Returns:
+                    curveidx (int): Index of the saved curve.
+    """
+    curveidx, savedir, writeindex = task
+    saveUFFtxt(_workeruff, _workeruff, savedir, curveidx, writeindex)
+    return curveidx
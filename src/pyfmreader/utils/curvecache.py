@@ -0,0 +1,181 @@
+# File containing the following classes:
+# CurveCache --------------------------------------------------
+# Class used to keep the most recently used force curves
+# of a file in memory, up to a maximum size in bytes.
+# Includes the following methods:
+# get()
+# put()
+# clear()
+# info()
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+from .lazydict import LazyDict
+
+def getcurvenbytes(force_curve):
+    """
+    Estimate the memory used by the data arrays of a force curve.
+
+            Parameters:
+                    force_curve (utils.forcecurve.ForceCurve): Force curve to measure.
+
+            Returns:
+                    nbytes (int): Number of bytes used by the arrays of all the segments.
+    """
+    nbytes = 0
+    seen = set()
+    for _, segment in force_curve.get_segments():
+        arrays = [segment.zheight, segment.vdeflection, segment.time, segment.indentation, segment.force]
+        # Raw data that is loaded lazily is not counted until it is loaded.
+        for data in (segment.segment_formated_data, segment._raw_data):
+            if isinstance(data, LazyDict):
+                # Do not convert the pending channels, count the raw data they use.
+                arrays.extend(data.loaded_values())
+                arrays.extend(data.pending_arrays())
+            elif data is not None:
+                arrays.extend(data.values())
+        for array in arrays:
+            # Arrays can be shared between attributes, count them once.
+            if isinstance(array, np.ndarray) and id(array) not in seen:
+                seen.add(id(array))
+                nbytes += array.nbytes
+    return nbytes
+
+class CurveCache:
+    """
+    Class used to keep the most recently used force curves
+    of a file in memory, up to a maximum size in bytes.
+
+    When adding a curve exceeds the maximum size, the least
+    recently used curves are evicted. Cached curves are shared
+    with the caller and can grow after they are added (i.e: lazy
+    channels converted or preprocessing results). The curve last
+    returned or added is measured again on the next get or put,
+    and all the curves are measured again by info.
+
+            Properties:
+                    maxbytes (int): Maximum size of the cached curves, in bytes.
+                    currbytes (int): Current size of the cached curves, in bytes.
+                    hits (int): Number of curves found in the cache.
+                    misses (int): Number of curves not found in the cache.
+
+            Methods:
+                    get
+                    put
+                    clear
+                    info
+    """
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.currbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._curves = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a curve from the cache and mark it as the most recently used.
+
+                Parameters:
+                        key (hashable): Key of the curve, normally its index.
+
+                Returns:
+                        force_curve (utils.forcecurve.ForceCurve): Cached curve, or None if not found.
+        """
+        with self._lock:
+            self._remeasurelast()
+            item = self._curves.get(key)
+            if item is None:
+                self.misses += 1
+                self._evict()
+                return None
+            self._curves.move_to_end(key)
+            self.hits += 1
+            # The curve may have grown since it was last returned.
+            self._resize(key, getcurvenbytes(item[0]))
+            self._evict()
+            return item[0]
+
+    def put(self, key, force_curve):
+        """
+        Add a curve to the cache, evicting the least recently used curves if needed.
+
+        Curves larger than the maximum size of the cache are not added.
+
+                Parameters:
+                        key (hashable): Key of the curve, normally its index.
+                        force_curve (utils.forcecurve.ForceCurve): Curve to cache.
+
+                Returns: None
+        """
+        nbytes = getcurvenbytes(force_curve)
+        if nbytes > self.maxbytes:
+            return
+        with self._lock:
+            self._remeasurelast()
+            if key in self._curves:
+                self.currbytes -= self._curves.pop(key)[1]
+            self._curves[key] = (force_curve, nbytes)
+            self.currbytes += nbytes
+            self._evict()
+
+    def _resize(self, key, nbytes):
+        # Update the size of a cached curve.
+        force_curve, oldnbytes = self._curves[key]
+        self._curves[key] = (force_curve, nbytes)
+        self.currbytes += nbytes - oldnbytes
+
+    def _remeasurelast(self):
+        # The curve last returned or added is the one most likely changed by the caller.
+        if self._curves:
+            key = next(reversed(self._curves))
+            self._resize(key, getcurvenbytes(self._curves[key][0]))
+
+    def _remeasure(self):
+        # Measure again all the cached curves, they can grow after they are added.
+        for key, (force_curve, _) in list(self._curves.items()):
+            self._resize(key, getcurvenbytes(force_curve))
+
+    def _evict(self):
+        # Evict the least recently used curves until the cache fits in maxbytes.
+        while self._curves and self.currbytes > self.maxbytes:
+            _, (_, evictednbytes) = self._curves.popitem(last=False)
+            self.currbytes -= evictednbytes
+
+    def clear(self):
+        """
+        Remove all the curves from the cache and reset the statistics.
+
+                Parameters: None
+
+                Returns: None
+        """
+        with self._lock:
+            self._curves.clear()
+            self.currbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """
+        Get the statistics of the cache.
+
+                Parameters: None
+
+                Returns:
+                        info (dict): Dictionary with the hits, misses, number of curves, current and maximum size in bytes.
+        """
+        with self._lock:
+            self._remeasure()
+            self._evict()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'curves': len(self._curves),
+                'currbytes': self.currbytes,
+                'maxbytes': self.maxbytes
+            }
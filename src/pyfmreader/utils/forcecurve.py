@@ -24,6 +24,12 @@ class ForceCurve:
             Methods:
                     get_segments
     """
+    # Fixed attributes, without a per instance __dict__.
+    __slots__ = (
+        'file_id', 'curve_index', 'extend_segments', 'retract_segments',
+        'pause_segments', 'modulation_segments'
+    )
+
     def __init__(self, curve_index, file_id):
         self.file_id = file_id
         self.curve_index = curve_index
@@ -0,0 +1,404 @@
+# File containing the following classes:
+# ForceMapSegment ----------------------------------------------
+# Class used to store the data of one segment of all the force
+# curves of a Force Volume file as stacked arrays.
+# Includes the following methods:
+# preprocess_segment()
+# get_force_vs_indentation()
+# ForceMap -----------------------------------------------------
+# Class used to store the data of all the force curves of a
+# Force Volume file as stacked arrays.
+# Includes the following methods:
+# from_curves()
+# get_segments()
+# preprocess_force_map()
+# shift_height()
+# get_force_vs_indentation()
+
+import numpy as np
+
+from .raggedarray import RaggedArray
+
+class _ChannelBuffer:
+    """
+    Hidden class used to copy the data of a channel of each curve into
+    a stacked array as the curves are loaded, see ForceMap.from_curves.
+
+    The array is preallocated from the expected number of curves and the
+    number of points of the first curve, and grows if they are exceeded.
+    """
+    def __init__(self, first, nb_curves, ragged):
+        first = np.asarray(first)
+        self.ragged = ragged
+        self.nb_rows = 0
+        if ragged:
+            self.offsets = [0]
+            self.values = np.empty(nb_curves * len(first), dtype=first.dtype)
+        else:
+            # Keep float32 data as float32, other data is stored as float64.
+            dtype = np.result_type(np.float32, first.dtype)
+            self.nb_cols = 0
+            self.values = np.full((nb_curves, len(first)), np.nan, dtype=dtype)
+
+    def append(self, data):
+        data = np.asarray(data)
+        dtype = np.result_type(self.values.dtype, data.dtype)
+        if dtype != self.values.dtype:
+            self.values = self.values.astype(dtype)
+        if self.ragged:
+            start = self.offsets[-1]
+            end = start + len(data)
+            if end > len(self.values):
+                self.values = self._grow(self.values, (max(end, 2 * len(self.values)),))
+            self.values[start:end] = data
+            self.offsets.append(end)
+        else:
+            nb_rows, nb_cols = self.values.shape
+            if self.nb_rows == nb_rows or len(data) > nb_cols:
+                shape = (2 * nb_rows if self.nb_rows == nb_rows else nb_rows, max(len(data), nb_cols))
+                self.values = self._grow(self.values, (max(shape[0], 1), shape[1]))
+            self.values[self.nb_rows, :len(data)] = data
+            self.nb_cols = max(self.nb_cols, len(data))
+        self.nb_rows += 1
+
+    @staticmethod
+    def _grow(values, shape):
+        grown = np.full(shape, np.nan, dtype=values.dtype) if values.ndim == 2 else np.empty(shape, dtype=values.dtype)
+        grown[tuple(slice(0, size) for size in values.shape)] = values
+        return grown
+
+    def finish(self):
+        # Copy the data only if more memory than needed was allocated.
+        if self.ragged:
+            end = self.offsets[-1]
+            values = self.values if end == len(self.values) else self.values[:end].copy()
+            return RaggedArray(values, self.offsets)
+        if self.values.shape == (self.nb_rows, self.nb_cols):
+            return self.values
+        return self.values[:self.nb_rows, :self.nb_cols].copy()
+
+def _flat(data):
+    # Elementwise operations work on the flat values of ragged data.
+    return data.values if isinstance(data, RaggedArray) else data
+
+def _wrap(template, values):
+    # Give the result of an elementwise operation the layout of template.
+    return template.with_values(values) if isinstance(template, RaggedArray) else values
+
+def _percurve(template, values):
+    # Broadcast one value per curve against the layout of template.
+    return template.repeat(values) if isinstance(template, RaggedArray) else values[:, np.newaxis]
+
+class ForceMapSegment:
+    """
+    Class used to store the data of one segment of all the force
+    curves of a Force Volume file as stacked arrays.
+
+    The data arrays have shape (nb_curves, max(nb_point)), the values
+    after the last point of each curve are NaN. If the map was built
+    with ragged=True, the data is stored as utils.raggedarray.RaggedArray
+    instead, without padding.
+
+            Properties:
+                    segment_id (str): Segment position in the ForceCurve (0, 1, 2, etc.)
+                    segment_type (str): Type of segment (Approach, Retract, Pause, Modulation)
+                    segment_code (str): Code to identify segment type (AP, RE, PA, MO)
+                    description (str): Description of the segment.
+                    force_setpoint_mode (str): Type of force setpoint (Relative, Absolute).
+                    nb_point (np.array): Number of data points of the segment in each curve.
+                    force_setpoint (np.array): Force setpoint of each curve (N).
+                    velocity (np.array): Ramp speed of each curve (m/s).
+                    sampling_rate (np.array): Sampling rate of each curve (Hz).
+                    z_displacement (np.array): Displacement in z axis of each curve (m).
+                    baseline_measured (np.array): Whether the deflection baseline was measured for each curve.
+                    baseline (np.array): Deflection baseline of each curve (V).
+                    segment_formated_data (dict): Formated segment data, stacked by channel.
+                    height_channel_key (str): Key to get the piezo height data from the segment_formated_data dict.
+                    zheight (np.array): Piezo height (m)
+                    vdeflection (np.array): Vertical deflection (m)
+                    time (np.array): Time (s) (optional)
+                    indentation (np.array): Indentation (m) (optional)
+                    force (np.array): Force (N) (optional)
+
+            Methods:
+                    preprocess_segment
+                    get_force_vs_indentation
+    """
+    def __init__(self, segment_id, segment_type):
+        self.segment_id = segment_id
+        self.segment_type = segment_type
+        self.segment_code = None
+        self.description = None
+        self.force_setpoint_mode = None
+        self.nb_point = None
+        self.force_setpoint = None
+        self.velocity = None
+        self.sampling_rate = None
+        self.z_displacement = None
+        self.baseline_measured = None
+        self.baseline = None
+        self.segment_formated_data = None
+        self.height_channel_key = None
+        self.zheight = None
+        self.vdeflection = None
+        self.time = None
+        self.indentation = None
+        self.force = None
+
+    def preprocess_segment(self, deflection_sens, height_channel_key, y0=None):
+        """
+        Computes Vertical Deflection in m and populates the vdeflection, zheight
+        and time properties for all the curves at once, see utils.segment.Segment.preprocess_segment.
+
+        vDeflection(m) = (vDeflection(V) - baseline(V)) * deflection_sens(m/V)
+
+        if y0 is not None:
+            vDeflection(m) = (vDeflection(V) - y0(V)) * deflection_sens(m/V)
+
+                Parameters:
+                        deflection_sens (float): In m/V
+                        height_channel_key (str): Dictionary key to find height data in self.segment_formated_data.
+                        y0 (float): Manual offset for the vertical deflection, in Volts.
+
+                Returns: None
+        """
+        data = self.segment_formated_data["vDeflection"]
+        deflection_v = _flat(data)
+        # The measured baseline takes precedence over y0, curve by curve.
+        offset = np.where(self.baseline_measured, self.baseline, 0 if y0 is None else y0)
+        if self.baseline_measured.any() or y0 is not None:
+            deflection_v = deflection_v - _percurve(data, offset).astype(deflection_v.dtype)
+        self.vdeflection = _wrap(data, deflection_v * deflection_v.dtype.type(deflection_sens))
+        self.height_channel_key = height_channel_key
+        self.zheight = self.segment_formated_data[height_channel_key]
+        if "time" in self.segment_formated_data:
+            self.time = self.segment_formated_data["time"]
+        else:
+            # Same values as np.linspace(0, nb_point * sampling_rate, nb_point, endpoint=False)
+            step = self.nb_point * self.sampling_rate / self.nb_point
+            dtype = _flat(self.zheight).dtype
+            if isinstance(self.zheight, RaggedArray):
+                position = np.arange(len(self.zheight.values)) - self.zheight.repeat(self.zheight.offsets[:-1])
+                self.time = self.zheight.with_values((position * self.zheight.repeat(step)).astype(dtype, copy=False))
+            else:
+                time = np.arange(self.zheight.shape[1]) * step[:, np.newaxis]
+                time[np.arange(self.zheight.shape[1]) >= self.nb_point[:, np.newaxis]] = np.nan
+                self.time = time.astype(dtype, copy=False)
+
+    def get_force_vs_indentation(self, poc, spring_constant):
+        """
+        Computes force vs indentation curves from deflection and piezo_height and populates
+        the indentation and force properties for all the curves at once.
+
+        Indentation = piezo_height(m) − deflection(m) − (piezo_height(CP)(m) − deflection(CP)(m))
+        Force = Kc(N/m) * deflection(m)
+
+                Reference: DOI:10.1002/jemt.22776
+
+                Parameters:
+                        poc (np.array): [poc_x, poc_y] in meters, or array of shape (nb_curves, 2)
+                                        with the point of contact of each curve.
+                        spring_constant (float): in N/m
+
+                Returns: None
+        """
+        poc = np.asarray(poc, dtype=np.float64)
+        # Set the center position to 0, 0 and get a force curve
+        nb_curves = len(self.nb_point)
+        center_force_x = np.broadcast_to(poc[..., 0] - poc[..., 1], (nb_curves,))
+        center_force_y = np.broadcast_to(poc[..., 1] * spring_constant, (nb_curves,))
+
+        zheight, vdeflection = _flat(self.zheight), _flat(self.vdeflection)
+        dtype = vdeflection.dtype
+        center_force_x = _percurve(self.vdeflection, center_force_x).astype(dtype)
+        center_force_y = _percurve(self.vdeflection, center_force_y).astype(dtype)
+        self.indentation = _wrap(self.vdeflection, zheight - vdeflection - center_force_x)
+        self.force = _wrap(self.vdeflection, vdeflection * dtype.type(spring_constant) - center_force_y)
+
+class ForceMap:
+    """
+    Class used to store the data of all the force curves of a
+    Force Volume file as stacked arrays.
+
+    Each segment is stored as a ForceMapSegment, containing one
+    array per channel with a row per curve, either padded with NaN
+    or as a utils.raggedarray.RaggedArray. The preprocessing
+    methods work on all the curves at once.
+
+            Properties:
+                    file_id (str): AFM File identifier
+                    curve_indices (np.array): Index of the force curve stored in each row.
+                    extend_segments (list): List containing approach segments.
+                    retract_segments (list): List containing retract segments.
+                    pause_segments (list): List containing pause segments.
+                    modulation_segments (list): List containing modulation segments.
+
+            Methods:
+                    from_curves
+                    get_segments
+                    preprocess_force_map
+                    shift_height
+                    get_force_vs_indentation
+    """
+    def __init__(self, file_id):
+        self.file_id = file_id
+        self.curve_indices = None
+        self.extend_segments = []
+        self.retract_segments = []
+        self.pause_segments = []
+        self.modulation_segments = []
+
+    @classmethod
+    def from_curves(cls, force_curves, file_id=None, ragged=False, nb_curves=None):
+        """
+        Build a ForceMap from force curves.
+
+        The curves are consumed one at a time, so they can be
+        given by a generator (i.e: uff.UFF.stream_curves). The data
+        of each curve is copied into the stacked arrays as soon as
+        it is received, so the curves can be released one by one.
+        All the curves must have the same segments.
+
+                Parameters:
+                        force_curves (iterable): utils.forcecurve.ForceCurve objects.
+                        file_id (str): AFM File identifier. If None, the one of the first curve is used.
+                        ragged (bool): If True, store the data of each channel as a RaggedArray,
+                                       using memory proportional to the number of points.
+                        nb_curves (int): Expected number of curves, used to preallocate the arrays.
+                                         If None, the arrays grow as the curves are received.
+
+                Returns:
+                        force_map (utils.forcemap.ForceMap): ForceMap containing the data of the curves.
+        """
+        curve_indices = []
+        layout = None
+        collected = {}
+        for force_curve in force_curves:
+            segments = force_curve.get_segments()
+            curvelayout = [(str(segid), segment.segment_type) for segid, segment in segments]
+            if layout is None:
+                layout = curvelayout
+                if file_id is None: file_id = force_curve.file_id
+                for (segid, _), (_, segment) in zip(layout, segments):
+                    collected[segid] = {
+                        'segment_code': segment.segment_code,
+                        'description': segment.description,
+                        'force_setpoint_mode': segment.force_setpoint_mode,
+                        'channels': {
+                            key: _ChannelBuffer(data, nb_curves or 1, ragged)
+                            for key, data in segment.segment_formated_data.items()
+                        },
+                        'scalars': {key: [] for key in ('nb_point', 'force_setpoint', 'velocity', 'sampling_rate', 'z_displacement', 'baseline_measured', 'baseline')}
+                    }
+            elif curvelayout != layout:
+                raise ValueError(f"Curve {force_curve.curve_index} does not have the same segments as the first curve.")
+            curve_indices.append(int(force_curve.curve_index))
+            for (segid, _), (_, segment) in zip(layout, segments):
+                channels = collected[segid]['channels']
+                if set(segment.segment_formated_data) != set(channels):
+                    raise ValueError(f"Curve {force_curve.curve_index} does not have the same channels as the first curve.")
+                for key, data in segment.segment_formated_data.items():
+                    channels[key].append(data)
+                metadata = segment.segment_metadata or {}
+                scalars = collected[segid]['scalars']
+                scalars['nb_point'].append(len(next(iter(segment.segment_formated_data.values()), [])))
+                for key in ('force_setpoint', 'velocity', 'sampling_rate', 'z_displacement'):
+                    value = getattr(segment, key)
+                    scalars[key].append(np.nan if value is None else value)
+                scalars['baseline_measured'].append(metadata.get('baseline_measured') is True)
+                scalars['baseline'].append(metadata.get('baseline', 0.0))
+
+        force_map = cls(file_id)
+        force_map.curve_indices = np.array(curve_indices, dtype=int)
+        for segid, segment_type in layout or []:
+            segment = ForceMapSegment(segid, segment_type)
+            segment.segment_code = collected[segid]['segment_code']
+            segment.description = collected[segid]['description']
+            segment.force_setpoint_mode = collected[segid]['force_setpoint_mode']
+            scalars = collected[segid]['scalars']
+            segment.nb_point = np.array(scalars['nb_point'], dtype=int)
+            for key in ('force_setpoint', 'velocity', 'sampling_rate', 'z_displacement', 'baseline'):
+                setattr(segment, key, np.array(scalars[key], dtype=np.float64))
+            segment.baseline_measured = np.array(scalars['baseline_measured'], dtype=bool)
+            channels = collected[segid]['channels']
+            segment.segment_formated_data = {key: channels.pop(key).finish() for key in list(channels)}
+            if segment_type == 'Approach': force_map.extend_segments.append((segid, segment))
+            elif segment_type == 'Retract': force_map.retract_segments.append((segid, segment))
+            elif segment_type == 'Pause': force_map.pause_segments.append((segid, segment))
+            elif segment_type == 'Modulation': force_map.modulation_segments.append((segid, segment))
+        return force_map
+
+    def get_segments(self):
+        """
+        Get all the force map segments ordered by their segment id.
+
+                Parameters: None
+
+                Returns: List containing all the force map segments sorted by their segment id.
+        """
+        force_map_segments = [
+            *self.extend_segments, *self.pause_segments, *self.modulation_segments, *self.retract_segments
+        ]
+        return sorted(force_map_segments, key=lambda x: int(x[0]))
+
+    def preprocess_force_map(self, deflection_sens, height_channel_key, y0=None):
+        """
+        Computes Vertical Deflection in m and populates the vdeflection, zheight
+        and time properties for each segment of all the curves, see utils.forcecurve.ForceCurve.preprocess_force_curve.
+
+        vDeflection(m) = (vDeflection(V) - baseline(V)) * deflection_sens(m/V)
+
+        if y0 is not None:
+            vDeflection(m) = (vDeflection(V) - y0(V)) * deflection_sens(m/V)
+
+                Parameters:
+                        deflection_sens (float): In m/V
+                        height_channel_key (str): Dictionary key to find height data in self.segment_formated_data.
+                        y0 (float): Manual offset for the vertical deflection, in Volts.
+
+                Returns: None
+        """
+        for _, segment in self.get_segments():
+            segment.preprocess_segment(deflection_sens, height_channel_key, y0)
+
+    def shift_height(self):
+        """
+        Shifts the values of zheight of each curve using the last zheight value
+        of its last retract segment. This operation is necessary to process JPK files.
+
+        xzero(m) = last zheight value of last retract segment
+        shifted zheight = xzero(m) − zheight(m)
+
+                Parameters: None
+
+                Returns: None
+        """
+        last_retract = self.retract_segments[-1][-1]
+        if isinstance(last_retract.zheight, RaggedArray):
+            xzero = last_retract.zheight.last() # Maximum height
+        else:
+            rows = np.arange(len(self.curve_indices))
+            xzero = last_retract.zheight[rows, last_retract.nb_point - 1] # Maximum height
+        for _, segment in self.get_segments():
+            zheight = segment.zheight
+            segment.zheight = _wrap(zheight, _percurve(zheight, xzero).astype(_flat(zheight).dtype) - _flat(zheight))
+
+    def get_force_vs_indentation(self, poc, spring_constant):
+        """
+        Computes force vs indentation curves from deflection and piezo_height and populates
+        the indentation and force properties for each segment of all the curves.
+
+        Indentation = piezo_height(m) − deflection(m) − (piezo_height(CP)(m) − deflection(CP)(m))
+        Force = Kc(N/m) * deflection(m)
+
+                Reference: DOI:10.1002/jemt.22776
+
+                Parameters:
+                        poc (np.array): [poc_x, poc_y] in meters, or array of shape (nb_curves, 2)
+                                        with the point of contact of each curve.
+                        spring_constant (float): in N/m
+
+                Returns: None
+        """
+        for _, segment in self.get_segments():
+            segment.get_force_vs_indentation(poc, spring_constant)
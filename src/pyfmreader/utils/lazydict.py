@@ -0,0 +1,117 @@
+# File containing the following classes:
+# LazyDict --------------------------------------------------
+# Dictionary whose values can be computed when they are
+# first accessed.
+# Includes the following methods:
+# set_lazy()
+# is_loaded()
+# loaded_values()
+# pending_arrays()
+
+from collections.abc import MutableMapping
+from functools import partial
+
+import numpy as np
+
+class LazyDict(MutableMapping):
+    """
+    Dictionary whose values can be computed when they are
+    first accessed (i.e: channel data converted from the raw
+    data stored in the file only when it is used).
+
+    A lazy value is given as a function without arguments. It is
+    called the first time the value is read and its result replaces it.
+    To pickle the dictionary, the functions must be picklable
+    (i.e: a functools.partial of a function defined at the top level of a module).
+
+            Methods:
+                    set_lazy
+                    is_loaded
+                    loaded_values
+                    pending_arrays
+    """
+    def __init__(self, *args, **kwargs):
+        self._items = {}
+        self._pending = set()
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        value = self._items[key]
+        if key in self._pending:
+            value = value()
+            self._items[key] = value
+            self._pending.discard(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._pending.discard(key)
+
+    def __delitem__(self, key):
+        del self._items[key]
+        self._pending.discard(key)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        items = ', '.join(f"{key!r}: <lazy>" if key in self._pending else f"{key!r}: {value!r}" for key, value in self._items.items())
+        return f"LazyDict({{{items}}})"
+
+    def set_lazy(self, key, loader):
+        """
+        Set a value that is computed when it is first accessed.
+
+                Parameters:
+                        key (hashable): Key of the value.
+                        loader (callable): Function without arguments returning the value.
+
+                Returns: None
+        """
+        self._items[key] = loader
+        self._pending.add(key)
+
+    def is_loaded(self, key):
+        """
+        Check if a value has already been computed.
+
+                Parameters:
+                        key (hashable): Key of the value.
+
+                Returns:
+                        loaded (bool): False if the value is still pending, True otherwise.
+        """
+        return key in self._items and key not in self._pending
+
+    def loaded_values(self):
+        """
+        Get the values already computed, without computing the pending ones.
+
+                Parameters: None
+
+                Returns:
+                        values (list): Values already computed.
+        """
+        return [value for key, value in self._items.items() if key not in self._pending]
+
+    def pending_arrays(self):
+        """
+        Get the arrays referenced by the pending values, i.e: the raw data
+        they are computed from, without computing them.
+
+        Only the arguments of functools.partial loaders are inspected.
+
+                Parameters: None
+
+                Returns:
+                        arrays (list): Arrays used by the pending values.
+        """
+        arrays = []
+        for key in self._pending:
+            loader = self._items[key]
+            if isinstance(loader, partial):
+                arrays.extend(arg for arg in (*loader.args, *loader.keywords.values()) if isinstance(arg, np.ndarray))
+        return arrays
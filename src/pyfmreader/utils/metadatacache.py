@@ -0,0 +1,111 @@
+# File containing the functions used to keep the metadata
+# parsed from AFM files in a persistent cache on disk, so
+# files can be opened again without parsing their headers.
+# The cache is stored in the directory given by the
+# PYFMREADER_CACHE_DIR environment variable or, by default,
+# in the user cache directory (~/.cache/pyfmreader).
+
+import os
+import hashlib
+import pickle
+import tempfile
+
+# Increase when the parsed metadata changes, to ignore older cache files.
+METADATA_CACHE_VERSION = 1
+
+def getmetadatacachedir():
+    """
+    Get the directory used to store the metadata cache.
+
+            Parameters: None
+
+            Returns:
+                    cachedir (str): Path to the cache directory.
+    """
+    cachedir = os.environ.get('PYFMREADER_CACHE_DIR')
+    if cachedir:
+        return cachedir
+    usercachedir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(usercachedir, 'pyfmreader')
+
+def getmetadatacachepath(filepath):
+    """
+    Get the path of the cache file of an AFM file.
+
+    The name of the cache file is computed from the absolute path, size and
+    modification time of the AFM file, so the cache is not used if the file changes.
+
+            Parameters:
+                    filepath (str): Path to the AFM file.
+
+            Returns:
+                    cachepath (str): Path to the cache file.
+    """
+    stat = os.stat(filepath)
+    key = f"{METADATA_CACHE_VERSION}|{os.path.abspath(filepath)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return os.path.join(getmetadatacachedir(), hashlib.sha1(key.encode()).hexdigest() + '.pkl')
+
+def loadmetadatacache(filepath):
+    """
+    Load the cached metadata of an AFM file.
+
+    Cache files are pickled, only use cache directories that are not writable by other users.
+
+            Parameters:
+                    filepath (str): Path to the AFM file.
+
+            Returns:
+                    state (dict): Cached metadata, or None if it is not in the cache.
+    """
+    try:
+        with open(getmetadatacachepath(filepath), 'rb') as f:
+            return pickle.load(f)
+    # A missing, partial or outdated cache file is a cache miss.
+    except Exception:
+        return None
+
+def savemetadatacache(filepath, state):
+    """
+    Save the metadata of an AFM file into the cache.
+
+    Errors writing the cache are ignored, the cache is only used to speed up loading files.
+
+            Parameters:
+                    filepath (str): Path to the AFM file.
+                    state (dict): Metadata to cache.
+
+            Returns: None
+    """
+    try:
+        cachepath = getmetadatacachepath(filepath)
+        os.makedirs(os.path.dirname(cachepath), exist_ok=True)
+        # Write to a temporary file first, so other processes never read a partial file.
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(cachepath), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, cachepath)
+        except BaseException:
+            os.remove(tmppath)
+            raise
+    # Metadata that can not be pickled (i.e: TypeError) is not cached either.
+    except Exception:
+        pass
+
+def clearmetadatacache():
+    """
+    Remove all the files of the metadata cache.
+
+            Parameters: None
+
+            Returns: None
+    """
+    cachedir = getmetadatacachedir()
+    if not os.path.isdir(cachedir):
+        return
+    for name in os.listdir(cachedir):
+        if name.endswith('.pkl'):
+            try:
+                os.remove(os.path.join(cachedir, name))
+            except OSError:
+                pass
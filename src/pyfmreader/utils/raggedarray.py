@@ -0,0 +1,205 @@
+# File containing the following classes:
+# RaggedArray --------------------------------------------------
+# Class used to store a list of 1D arrays of different lengths
+# as a single flat array and an array of offsets.
+# Includes the following methods:
+# from_arrays()
+# with_values()
+# repeat()
+# first()
+# last()
+# reduce()
+# sum()
+# min()
+# max()
+# mean()
+# to_padded()
+
+import numpy as np
+
+class RaggedArray:
+    """
+    Class used to store a list of 1D arrays of different lengths
+    (i.e: the data of a segment in all the curves of a map) as a
+    single flat array and an array of offsets.
+
+    Row i is values[offsets[i]:offsets[i+1]], and getting a row
+    returns a view of the flat array, without copying the data.
+
+            Properties:
+                    values (np.array): Flat array with the data of all the rows.
+                    offsets (np.array): Position of each row in values, of length nb_rows + 1.
+                    lengths (np.array): Number of values of each row.
+
+            Methods:
+                    from_arrays
+                    with_values
+                    repeat
+                    first
+                    last
+                    reduce
+                    sum
+                    min
+                    max
+                    mean
+                    to_padded
+    """
+    def __init__(self, values, offsets):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if offsets.ndim != 1 or len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(values):
+            raise ValueError("The offsets must start at 0 and end at the number of values.")
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_arrays(cls, arrays, dtype=None):
+        """
+        Build a RaggedArray from a list of 1D arrays.
+
+                Parameters:
+                        arrays (list): List of 1D arrays, one per row.
+                        dtype (np.dtype): Data type of the values. If None, it is computed from the arrays.
+
+                Returns:
+                        ragged (utils.raggedarray.RaggedArray): RaggedArray containing the arrays.
+        """
+        arrays = [np.asarray(array) for array in arrays]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([len(array) for array in arrays], out=offsets[1:])
+        if dtype is None:
+            dtype = np.result_type(*[array.dtype for array in arrays]) if arrays else np.float64
+        values = np.empty(offsets[-1], dtype=dtype)
+        for i, array in enumerate(arrays):
+            values[offsets[i]:offsets[i + 1]] = array
+        return cls(values, offsets)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.offsets.nbytes
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if idx < 0: idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Row {idx} out of range for a RaggedArray with {len(self)} rows.")
+        return self.values[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __repr__(self):
+        return f"RaggedArray(rows={len(self)}, values={len(self.values)}, dtype={self.dtype})"
+
+    def with_values(self, values):
+        """
+        Build a RaggedArray with the same rows, but different values.
+
+                Parameters:
+                        values (np.array): Flat array of the same length as self.values.
+
+                Returns:
+                        ragged (utils.raggedarray.RaggedArray): RaggedArray sharing the offsets of this one.
+        """
+        return RaggedArray(values, self.offsets)
+
+    def repeat(self, rowvalues):
+        """
+        Broadcast one value per row to the flat layout of the values.
+
+                Parameters:
+                        rowvalues (np.array): Array of length nb_rows.
+
+                Returns:
+                        flat (np.array): Array of the same length as self.values.
+        """
+        return np.repeat(np.asarray(rowvalues), self.lengths)
+
+    def first(self, fill=np.nan):
+        """
+        Get the first value of each row.
+
+                Parameters:
+                        fill (float): Value used for empty rows.
+
+                Returns:
+                        first (np.array): Array of length nb_rows.
+        """
+        return self._rowvalues(self.offsets[:-1], fill)
+
+    def last(self, fill=np.nan):
+        """
+        Get the last value of each row.
+
+                Parameters:
+                        fill (float): Value used for empty rows.
+
+                Returns:
+                        last (np.array): Array of length nb_rows.
+        """
+        return self._rowvalues(self.offsets[1:] - 1, fill)
+
+    def _rowvalues(self, positions, fill):
+        nonempty = self.lengths > 0
+        result = np.full(len(self), fill, dtype=np.result_type(self.dtype, np.min_scalar_type(fill)))
+        result[nonempty] = self.values[positions[nonempty]]
+        return result
+
+    def reduce(self, ufunc, fill=np.nan):
+        """
+        Reduce each row with a NumPy ufunc (i.e: np.add, np.minimum, np.maximum),
+        for all the rows at once.
+
+                Parameters:
+                        ufunc (np.ufunc): Binary ufunc used to reduce the values of each row.
+                        fill (float): Value used for empty rows.
+
+                Returns:
+                        reduced (np.array): Array of length nb_rows.
+        """
+        nonempty = self.lengths > 0
+        reduced = ufunc.reduceat(self.values, self.offsets[:-1][nonempty]) if nonempty.any() else self.values[:0]
+        result = np.full(len(self), fill, dtype=np.result_type(reduced.dtype, np.min_scalar_type(fill)))
+        # Empty rows have no values between two offsets, so skipping them
+        # does not change the values reduced for the other rows.
+        result[nonempty] = reduced
+        return result
+
+    def sum(self):
+        return self.reduce(np.add, fill=0)
+
+    def min(self):
+        return self.reduce(np.minimum)
+
+    def max(self):
+        return self.reduce(np.maximum)
+
+    def mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.reduce(np.add) / self.lengths
+
+    def to_padded(self, fill=np.nan):
+        """
+        Convert the RaggedArray into a 2D array, padding the rows with a fill value.
+
+                Parameters:
+                        fill (float): Value used after the last value of each row.
+
+                Returns:
+                        padded (np.array): 2D array of shape (nb_rows, max(lengths)).
+        """
+        lengths = self.lengths
+        padded = np.full((len(self), int(lengths.max(initial=0))), fill, dtype=np.result_type(self.dtype, np.min_scalar_type(fill)))
+        mask = np.arange(padded.shape[1]) < lengths[:, np.newaxis]
+        padded[mask] = self.values
+        return padded
@@ -9,6 +9,19 @@
 
 import numpy as np
 
+def getfloattype(data):
+    """
+    Get the floating point type used to compute with an array.
+
+            Parameters:
+                    data (np.array): Data array.
+            
+            Returns:
+                    dtype (type): Floating point type of the array, or np.float64 if the array is not floating point.
+    """
+    data = np.asarray(data)
+    return data.dtype.type if np.issubdtype(data.dtype, np.floating) else np.float64
+
 class Segment:
     """
     Class used to store the data and metadata of the different
@@ -28,7 +41,8 @@ class Segment:
                     sampling_rate (float): Sampling rate (Hz).
                     z_displacement (float): Displacement in z axis (m).
                     segment_metadata (dict): Additional metadata (optional).
-                    segment_raw_data (dict): Segment raw data (optional)
+                    segment_raw_data (dict): Segment raw data (optional). If a raw data loader is set,
+                                             it is loaded when first accessed (see set_raw_loader).
                     segment_formated_data (dict): Formated segment data.
                     height_channel_key (str): Key to get the piezo height data from the segment_formated_data dict.
                     zheight (np.array): Piezo height (m)
@@ -38,10 +52,21 @@ class Segment:
                     force (np.array): Force (N) (optional)
             
             Methods:
+                    set_raw_loader
                     preprocess_segment
                     get_force_vs_indentation_curve
 
     """
+    # Fixed attributes, without a per instance __dict__,
+    # to reduce the memory used by each segment.
+    __slots__ = (
+        'file_id', 'segment_id', 'segment_type', 'segment_code', 'description',
+        'nb_point', 'force_setpoint_mode', 'nb_col', 'force_setpoint', 'velocity',
+        'sampling_rate', 'z_displacement', 'segment_metadata', '_raw_data', '_raw_loader',
+        'segment_formated_data', 'height_channel_key', 'zheight', 'vdeflection',
+        'time', 'indentation', 'force'
+    )
+
     def __init__(self, file_id, segment_id, segment_type):
         self.file_id = file_id                  
         self.segment_id = segment_id            
@@ -56,7 +81,8 @@ class Segment:
         self.sampling_rate = None
         self.z_displacement = None
         self.segment_metadata = None
-        self.segment_raw_data = None
+        self._raw_data = None
+        self._raw_loader = None
         self.segment_formated_data = None
         self.height_channel_key = None
         self.zheight = None
@@ -69,6 +95,33 @@ class Segment:
         elif self.segment_type == 'Retract': self.segment_code = 'RE'
         elif self.segment_type == 'Pause': self.segment_code = 'PA'
         elif self.segment_type == 'Modulation': self.segment_code = 'MO'
+
+    @property
+    def segment_raw_data(self):
+        if self._raw_data is None and self._raw_loader is not None:
+            self._raw_data = self._raw_loader()
+        return self._raw_data
+
+    @segment_raw_data.setter
+    def segment_raw_data(self, raw_data):
+        self._raw_data = raw_data
+        self._raw_loader = None
+
+    def set_raw_loader(self, raw_loader):
+        """
+        Sets a function used to load the raw data of the segment when
+        segment_raw_data is first accessed, instead of keeping it in memory.
+
+        The function must be picklable (i.e: a functools.partial of a
+        function defined at the top level of a module) to pickle the segment.
+
+                Parameters:
+                        raw_loader (callable): Function without arguments returning the segment raw data (dict).
+                
+                Returns: None
+        """
+        self._raw_data = None
+        self._raw_loader = raw_loader
     
     def preprocess_segment(self, deflection_sens, height_channel_key, y0=None):
         """
@@ -88,18 +141,20 @@ class Segment:
                 Returns: None
         """
         deflection_v = self.segment_formated_data["vDeflection"]
+        # Scalars are cast to the type of the data, so float32 data stays float32.
+        dtype = getfloattype(deflection_v)
         if self.segment_metadata is not None and\
             self.segment_metadata["baseline_measured"]:
-            deflection_v = deflection_v - self.segment_metadata["baseline"]
+            deflection_v = deflection_v - dtype(self.segment_metadata["baseline"])
         elif y0 is not None:
-            deflection_v = deflection_v - y0
-        self.vdeflection = deflection_v * deflection_sens
+            deflection_v = deflection_v - dtype(y0)
+        self.vdeflection = deflection_v * dtype(deflection_sens)
         self.zheight = self.segment_formated_data[height_channel_key]
         if "time" in self.segment_formated_data:
             self.time = self.segment_formated_data["time"]
         elif self.sampling_rate is not None:
             segment_duration = self.nb_point * self.sampling_rate
-            self.time = np.linspace(0, segment_duration, self.nb_point, endpoint=False)
+            self.time = np.linspace(0, segment_duration, self.nb_point, endpoint=False, dtype=dtype)
     
     def get_force_vs_indentation(self, poc, spring_constant):
         """
@@ -123,5 +178,6 @@ class Segment:
 
         # Indentation = piezo_height(m) − deflection(m) − (piezo_height(CP)(m) − deflection(CP)(m))
         # Force = Kc(N/m) * deflection(m)
-        self.indentation = np.array(self.zheight - self.vdeflection - center_force_x)
-        self.force = np.array(self.vdeflection * spring_constant - center_force_y)
\ No newline at end of file
+        dtype = getfloattype(self.vdeflection)
+        self.indentation = np.array(self.zheight - self.vdeflection - dtype(center_force_x))
+        self.force = np.array(self.vdeflection * dtype(spring_constant) - dtype(center_force_y))
\ No newline at end of file
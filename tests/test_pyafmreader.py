@@ -2,8 +2,28 @@
 
 # NOT FINISHED!!!
 
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import threading
 import unittest
+from unittest import mock
+
+import numpy as np
+
 from pyfmreader import loadfile
+from pyfmreader import save_uff
+from pyfmreader.jpk import loadjpkfile
+from pyfmreader.nanosc.loadnanoscimg import loadNANOSCimg
+from pyfmreader.load_uff import saveUFFindex, loadUFFindex
+from pyfmreader.save_uff import saveUFFtxt, getUFFtxtpath
+from pyfmreader.utils import curvecache
+from pyfmreader.utils.curvecache import CurveCache, getcurvenbytes
+from pyfmreader.utils.forcemap import ForceMap
+from pyfmreader.utils.lazydict import LazyDict
+from pyfmreader.utils.metadatacache import getmetadatacachepath, loadmetadatacache, savemetadatacache
 
 class TestPyafmreader(unittest.TestCase):
 
@@ -184,5 +204,491 @@ class TestPyafmreader(unittest.TestCase):
     def test_load_UFF_header(self):
         pass
 
+class TestJPKPiezoImg(unittest.TestCase):
+
+    def setUp(self):
+        self.JPK_FV_FILE = loadfile('tests/testfiles/map-data-2021.11.05-17.37.44.432.jpk-force-map')
+
+    def test_piezoimg_from_curves(self):
+        metadata = self.JPK_FV_FILE.filemetadata
+        height_channel_key = metadata['height_channel_key']
+        piezoimg = self.JPK_FV_FILE.getpiezoimg(use_imagedata=False)
+        heights = np.array([FC.extend_segments[0][1].segment_formated_data[height_channel_key][-1] for FC in self.JPK_FV_FILE.getcurves()])
+        heights = (heights - heights.min()).reshape((metadata['num_x_pixels'], metadata['num_y_pixels']))
+        # Odd rows are flipped to follow the raster scan direction.
+        heights[1::2] = heights[1::2, ::-1]
+        np.testing.assert_allclose(piezoimg, heights, rtol=0, atol=1e-15)
+
+    def test_piezoimg_from_imagedata(self):
+        self.assertEqual(self.JPK_FV_FILE.filemetadata['height_channel_key'], 'measuredHeight')
+        image = self.JPK_FV_FILE.imagedata['Height(measured)']
+        np.testing.assert_array_equal(self.JPK_FV_FILE.getpiezoimg(), image - image.min())
+        # The recorded height image is not the last approach value of each curve.
+        self.assertFalse(np.allclose(self.JPK_FV_FILE.getpiezoimg(), self.JPK_FV_FILE.getpiezoimg(use_imagedata=False)))
+
+    def test_piezoimg_uses_height_channel_key(self):
+        self.JPK_FV_FILE.filemetadata['height_channel_key'] = 'height'
+        image = self.JPK_FV_FILE.imagedata['Height']
+        np.testing.assert_array_equal(self.JPK_FV_FILE.getpiezoimg(), image - image.min())
+
+class TestNANOSCPiezoImg(unittest.TestCase):
+
+    def test_piezoimg_subsampled_to_curve_grid(self):
+        # Image with 8 samples per line and 4 force curves per line, followed by force data.
+        image = np.arange(4 * 8, dtype='<i2').reshape(4, 8)
+        header = {
+            'FV_ima_offset': 16, 'FV_nb_lines': 4, 'FV_nb_sampsline': 8, 'FDC_nb_sampsline': 4,
+            'FV_data_length': image.nbytes, 'FV_Zsens': 1.0, 'zscan_sens_nmbyV': 2. ** 16, 'byte_per_pixel': 2
+        }
+        buffer = io.BytesIO(bytes(16) + image.tobytes() + np.full(64, 10000, dtype='<i2').tobytes())
+        piezoimg = loadNANOSCimg(header, buffer)
+        expected = image[:, ::2].astype(np.float64)
+        np.testing.assert_array_equal(piezoimg[:, :, 0], expected - expected.min())
+        # The image block is read without reading the force data after it.
+        self.assertEqual(buffer.tell(), 16 + image.nbytes)
+
+class TestCurveCache(unittest.TestCase):
+
+    def setUp(self):
+        self.JPK_FV_FILE = loadfile('tests/testfiles/map-data-2021.11.05-17.37.44.432.jpk-force-map', lazy_conversion=True)
+
+    def test_cache_counts_data_added_to_cached_curves(self):
+        self.JPK_FV_FILE.set_cache(3_000_000)
+        height_channel_key = self.JPK_FV_FILE.filemetadata['height_channel_key']
+        for curveidx in range(4):
+            FC = self.JPK_FV_FILE.getcurve(curveidx)
+            FC.preprocess_force_curve(1e-8, height_channel_key)
+            FC.get_force_vs_indentation([0, 0], 0.1)
+        cache = self.JPK_FV_FILE._curvecache
+        info = self.JPK_FV_FILE.cache_info()
+        held = sum(getcurvenbytes(FC) for FC, _ in cache._curves.values())
+        self.assertEqual(info['currbytes'], held)
+        self.assertLessEqual(info['currbytes'], info['maxbytes'])
+
+    def test_put_does_not_measure_all_curves(self):
+        cache = CurveCache(10 ** 12)
+        FC = self.JPK_FV_FILE.getcurve(0)
+        with mock.patch.object(curvecache, 'getcurvenbytes', wraps=curvecache.getcurvenbytes) as getnbytes:
+            for key in range(500):
+                cache.put(key, FC)
+                cache.get(key)
+        # Each put and get measures at most the curve added or returned and the last one used.
+        self.assertLessEqual(getnbytes.call_count, 4 * 500)
+        self.assertEqual(cache.info()['curves'], 500)
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+JPK_FV_PATH = 'tests/testfiles/map-data-2021.11.05-17.37.44.432.jpk-force-map'
+NANOSC_SINGLE_CURVE_PATH = 'tests/testfiles/20200904_Egel4-Z1.0_00025.spm'
+NANOSC_FV_PATH = 'tests/testfiles/20200903_Egel2.0_00023.spm'
+UFF_PATH = 'tests/testfiles/20200904_Egel4-Z1.0_00025.uff'
+
+class CurveAssertions:
+
+    def assertSameCurve(self, FC, expected, dtype=None, rtol=0):
+        # Segment ids are saved as int or str depending on the file format.
+        segments = {int(segid): segment for segid, segment in FC.get_segments()}
+        expected_segments = {int(segid): segment for segid, segment in expected.get_segments()}
+        self.assertEqual(sorted(segments), sorted(expected_segments))
+        for segid, expected_segment in expected_segments.items():
+            segment = segments[segid]
+            self.assertEqual(segment.segment_type, expected_segment.segment_type)
+            self.assertEqual(segment.nb_point, len(expected_segment.segment_formated_data[next(iter(expected_segment.segment_formated_data))]))
+            for field in ('velocity', 'sampling_rate', 'z_displacement', 'force_setpoint'):
+                np.testing.assert_allclose(getattr(segment, field), getattr(expected_segment, field), rtol=rtol)
+            self.assertEqual(list(segment.segment_formated_data), list(expected_segment.segment_formated_data))
+            for column, values in expected_segment.segment_formated_data.items():
+                values = np.asarray(values) if dtype is None else np.asarray(values).astype(dtype)
+                np.testing.assert_allclose(segment.segment_formated_data[column], values, rtol=rtol)
+
+@unittest.skipIf(h5py is None, "h5py is not installed")
+class TestSaveUFFhdf5(CurveAssertions, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def roundtrip(self, filepath):
+        uff = loadfile(filepath)
+        savefile = os.path.join(self.tmpdir.name, os.path.basename(filepath) + '.uff.h5')
+        uff.to_hdf5(savefile)
+        return uff, loadfile(savefile)
+
+    def assertSameFile(self, uff, h5uff):
+        self.assertEqual(h5uff.filemetadata['file_type'], 'uff.h5')
+        self.assertEqual(h5uff.isFV, bool(uff.isFV))
+        nb_curves = uff.filemetadata['Entry_tot_nb_curve'] if uff.isFV else 1
+        self.assertEqual(h5uff.filemetadata['Entry_tot_nb_curve'], nb_curves)
+        for curveidx, FC in enumerate(h5uff.getcurves(range(nb_curves))):
+            self.assertSameCurve(FC, uff.getcurve(curveidx))
+
+    def test_save_JPK_FV(self):
+        self.assertSameFile(*self.roundtrip(JPK_FV_PATH))
+
+    def test_save_NANOSC_FV(self):
+        self.assertSameFile(*self.roundtrip(NANOSC_FV_PATH))
+
+    def test_save_NANOSC_single_curve(self):
+        self.assertSameFile(*self.roundtrip(NANOSC_SINGLE_CURVE_PATH))
+
+    def test_save_UFF(self):
+        self.assertSameFile(*self.roundtrip(UFF_PATH))
+
+@unittest.skipIf(h5py is None, "h5py is not installed")
+class TestLoadUFFhdf5(CurveAssertions, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.savefile = os.path.join(self.tmpdir.name, 'map.uff.h5')
+        self.JPK_FV_FILE = loadfile(JPK_FV_PATH)
+
+    def test_load_float32(self):
+        self.JPK_FV_FILE.to_hdf5(self.savefile)
+        h5uff = loadfile(self.savefile, dtype=np.float32)
+        for curveidx in (0, 7):
+            FC = h5uff.getcurve(curveidx)
+            for _, segment in FC.get_segments():
+                for values in segment.segment_formated_data.values():
+                    self.assertEqual(values.dtype, np.float32)
+            self.assertSameCurve(FC, self.JPK_FV_FILE.getcurve(curveidx), dtype=np.float32)
+
+    def test_load_piezoimg(self):
+        self.JPK_FV_FILE.to_hdf5(self.savefile)
+        h5uff = loadfile(self.savefile)
+        np.testing.assert_array_equal(h5uff.getpiezoimg(), self.JPK_FV_FILE.getpiezoimg())
+
+    def test_load_missing_segments(self):
+        FCs = self.JPK_FV_FILE.getcurves()
+        # Curve 1 has no retract segments, they are saved with offset length 0.
+        retract_segids = [segid for segid, _ in FCs[1].retract_segments]
+        FCs[1].retract_segments = []
+        self.JPK_FV_FILE.stream_curves = lambda *args, **kwargs: iter(FCs)
+        self.JPK_FV_FILE.to_hdf5(self.savefile)
+        h5uff = loadfile(self.savefile)
+        with h5py.File(self.savefile, 'r') as h5file:
+            for segid in retract_segids:
+                offsets = h5file['segments'][str(segid)]['offsets'][()]
+                self.assertEqual(offsets[2] - offsets[1], 0)
+        self.assertEqual(h5uff.getcurve(1).retract_segments, [])
+        for curveidx, FC in enumerate(FCs):
+            self.assertSameCurve(h5uff.getcurve(curveidx), FC)
+
+class TestUFFtxt(CurveAssertions, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.JPK_FV_FILE = loadfile(JPK_FV_PATH)
+
+    def savecurve(self, curveidx, writeindex=False):
+        saveUFFtxt(None, self.JPK_FV_FILE, self.tmpdir.name, curveidx, writeindex)
+        return getUFFtxtpath(self.JPK_FV_FILE, self.tmpdir.name, curveidx)
+
+    def test_load_map_curve(self):
+        uff = loadfile(self.savecurve(7))
+        nb_curves = self.JPK_FV_FILE.filemetadata['Entry_tot_nb_curve']
+        self.assertEqual(uff.filemetadata['Entry_tot_nb_curve'], 1)
+        self.assertEqual(uff.filemetadata['source_Entry_tot_nb_curve'], nb_curves)
+        FCs = uff.getcurves()
+        self.assertEqual(len(FCs), 1)
+        self.assertEqual(FCs[0].curve_index, 7)
+        # Values are saved with 7 significant digits.
+        self.assertSameCurve(FCs[0], self.JPK_FV_FILE.getcurve(7), rtol=1e-6)
+        self.assertSameCurve(uff.getcurve(7), FCs[0])
+        with self.assertRaises(IndexError):
+            uff.getcurve(3)
+
+    def test_load_indexed_CRLF_file(self):
+        uffpath = os.path.join(self.tmpdir.name, os.path.basename(UFF_PATH))
+        with open(UFF_PATH, 'rb') as f:
+            data = f.read().replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+        with open(uffpath, 'wb') as f:
+            f.write(data)
+        saveUFFindex(uffpath)
+        self.assertIsNotNone(loadUFFindex(uffpath))
+        uff = loadfile(uffpath)
+        expected = loadfile(UFF_PATH)
+        self.assertEqual(uff.filemetadata['Recording_segment_0_type'], 'Approach')
+        FC = uff.getcurve(0)
+        self.assertEqual(len(FC.get_segments()), len(expected.getcurve(0).get_segments()))
+        self.assertSameCurve(FC, expected.getcurve(0))
+
+    def test_index_ignored_when_file_changes(self):
+        uffpath = self.savecurve(7, writeindex=True)
+        self.assertIsNotNone(loadUFFindex(uffpath))
+        stat = os.stat(uffpath)
+        os.utime(uffpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        self.assertIsNone(loadUFFindex(uffpath))
+
+    def test_resume_interrupted_export(self):
+        nb_curves = self.JPK_FV_FILE.filemetadata['Entry_tot_nb_curve']
+        writeUFFsegment = save_uff.writeUFFsegment
+        calls = []
+        def interrupt(f, FDC):
+            # Interrupt the export while the third curve is written.
+            calls.append(FDC.curve_index)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            writeUFFsegment(f, FDC)
+        with mock.patch.object(save_uff, 'writeUFFsegment', interrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.JPK_FV_FILE.to_txt(self.tmpdir.name)
+        paths = [getUFFtxtpath(self.JPK_FV_FILE, self.tmpdir.name, curveidx) for curveidx in range(nb_curves)]
+        saved = paths[:2]
+        # The interrupted curve is only saved under its temporary name.
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), sorted(os.path.basename(path) for path in saved + [paths[2] + '.part']))
+        mtimes = [os.stat(path).st_mtime_ns for path in saved]
+
+        progress = []
+        self.JPK_FV_FILE.to_txt(self.tmpdir.name, resume=True, progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(progress[0], (2, nb_curves))
+        self.assertEqual(progress[-1], (nb_curves, nb_curves))
+        self.assertEqual(len(progress), nb_curves - 1)
+        self.assertEqual([os.stat(path).st_mtime_ns for path in saved], mtimes)
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), sorted(os.path.basename(path) for path in paths))
+
+        # With all the curves saved, progress is reported once.
+        progress = []
+        self.JPK_FV_FILE.to_txt(self.tmpdir.name, resume=True, progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(progress, [(nb_curves, nb_curves)])
+
+class TestForceMap(unittest.TestCase):
+
+    def setUp(self):
+        self.JPK_FV_FILE = loadfile(JPK_FV_PATH)
+
+    def test_from_curves_without_nb_curves(self):
+        for ragged in (False, True):
+            FM = self.JPK_FV_FILE.getforcemap(ragged=ragged)
+            for nb_curves in (None, 3):
+                grown = ForceMap.from_curves(self.JPK_FV_FILE.stream_curves(), ragged=ragged, nb_curves=nb_curves)
+                np.testing.assert_array_equal(grown.curve_indices, FM.curve_indices)
+                for (segid, segment), (_, expected) in zip(grown.get_segments(), FM.get_segments()):
+                    np.testing.assert_array_equal(segment.nb_point, expected.nb_point)
+                    for key, data in expected.segment_formated_data.items():
+                        if ragged:
+                            np.testing.assert_array_equal(segment.segment_formated_data[key].offsets, data.offsets)
+                            data, grown_data = data.values, segment.segment_formated_data[key].values
+                        else:
+                            grown_data = segment.segment_formated_data[key]
+                        self.assertEqual(grown_data.dtype, data.dtype)
+                        np.testing.assert_array_equal(grown_data, data)
+
+    def test_curves_are_copied_into_the_map(self):
+        FM = self.JPK_FV_FILE.getforcemap()
+        for curveidx, FC in enumerate(self.JPK_FV_FILE.getcurves()):
+            for (_, segment), (_, map_segment) in zip(FC.get_segments(), FM.get_segments()):
+                nb_point = map_segment.nb_point[curveidx]
+                for key, data in segment.segment_formated_data.items():
+                    row = map_segment.segment_formated_data[key][curveidx]
+                    np.testing.assert_array_equal(row[:nb_point], data)
+                    self.assertTrue(np.isnan(row[nb_point:]).all())
+
+def getcurvedata(FC):
+    # Used by the worker processes of UFF.map_curves.
+    return {int(segid): dict(segment.segment_formated_data) for segid, segment in FC.get_segments()}
+
+def workerhascache(FC):
+    # Used by the worker processes of UFF.map_curves.
+    from pyfmreader import uff
+    return uff._workeruff._curvecache is not None
+
+class TestMapCurves(CurveAssertions, unittest.TestCase):
+
+    def assertSameData(self, data, FC):
+        self.assertEqual(data.keys(), getcurvedata(FC).keys())
+        for segid, channels in getcurvedata(FC).items():
+            self.assertEqual(list(data[segid]), list(channels))
+            for key, values in channels.items():
+                np.testing.assert_array_equal(data[segid][key], values)
+
+    def test_map_curves(self):
+        for filepath in (JPK_FV_PATH, NANOSC_FV_PATH):
+            uff = loadfile(filepath)
+            indices = [5, 0, 3]
+            FCs = uff.map_curves(indices=indices, processes=2)
+            self.assertEqual([FC.curve_index for FC in FCs], indices)
+            for curveidx, FC in zip(indices, FCs):
+                self.assertSameCurve(FC, uff.getcurve(curveidx))
+
+    def test_map_curves_func(self):
+        uff = loadfile(JPK_FV_PATH)
+        results = uff.map_curves(getcurvedata, processes=2)
+        self.assertEqual(len(results), uff.filemetadata['Entry_tot_nb_curve'])
+        for curveidx, data in enumerate(results):
+            self.assertSameData(data, uff.getcurve(curveidx))
+
+    def test_map_curves_memmap(self):
+        uff = loadfile(NANOSC_FV_PATH, memmap=True)
+        self.assertIsNotNone(uff.forcevolume)
+        results = uff.map_curves(getcurvedata, indices=range(0, 256, 51), processes=2)
+        expected = loadfile(NANOSC_FV_PATH)
+        for curveidx, data in zip(range(0, 256, 51), results):
+            self.assertSameData(data, expected.getcurve(curveidx))
+
+    def test_map_curves_UFF(self):
+        uff = loadfile(UFF_PATH)
+        FCs = uff.map_curves(processes=2)
+        self.assertEqual(len(FCs), 1)
+        self.assertSameCurve(FCs[0], uff.getcurve(0))
+
+    def test_workers_do_not_use_cache(self):
+        uff = loadfile(JPK_FV_PATH)
+        uff.set_cache(10_000_000)
+        self.assertEqual(uff.map_curves(workerhascache, indices=range(4), processes=2), [False] * 4)
+
+    def test_pickle_remaps_forcevolume(self):
+        uff = loadfile(NANOSC_FV_PATH, memmap=True)
+        with uff:
+            copy = pickle.loads(pickle.dumps(uff))
+        self.assertIsNone(copy._afmfile)
+        self.assertIsNone(copy._curvecache)
+        self.assertIsInstance(copy.forcevolume, np.memmap)
+        np.testing.assert_array_equal(copy.forcevolume, uff.forcevolume)
+        self.assertSameCurve(copy.getcurve(17), uff.getcurve(17))
+
+class TestIterCurves(CurveAssertions, unittest.TestCase):
+
+    def assertSameCurves(self, uff, expected):
+        nb_curves = uff.filemetadata['Entry_tot_nb_curve']
+        FCs = list(uff.iter_curves(prefetch=3, threads=2))
+        self.assertEqual([FC.curve_index for FC in FCs], list(range(nb_curves)))
+        for curveidx, FC in enumerate(FCs):
+            self.assertSameCurve(FC, expected.getcurve(curveidx))
+
+    def test_prefetch_JPK(self):
+        expected = loadfile(JPK_FV_PATH)
+        self.assertSameCurves(loadfile(JPK_FV_PATH), expected)
+        # Segment headers are parsed from the worker threads in lazy mode.
+        uff = loadfile(JPK_FV_PATH, lazy=True)
+        self.assertSameCurves(uff, expected)
+        self.assertEqual(len(uff.filemetadata['curve_properties']), uff.filemetadata['Entry_tot_nb_curve'])
+
+    def test_prefetch_NANOSC(self):
+        self.assertSameCurves(loadfile(NANOSC_FV_PATH), loadfile(NANOSC_FV_PATH))
+
+    def test_prefetch_UFF(self):
+        self.assertSameCurves(loadfile(UFF_PATH), loadfile(UFF_PATH))
+
+    def test_prefetch_indices(self):
+        uff = loadfile(NANOSC_FV_PATH)
+        indices = [200, 3, 3, 41]
+        FCs = list(uff.iter_curves(indices, prefetch=2, threads=3))
+        self.assertEqual([FC.curve_index for FC in FCs], indices)
+
+    def test_thread_buffers_closed_early(self):
+        uff = loadfile(NANOSC_FV_PATH)
+        buffers = []
+        openfile = uff._openfile
+        def recordopenfile():
+            buffers.append(openfile())
+            return buffers[-1]
+        uff._openfile = recordopenfile
+        FCs = uff.iter_curves(prefetch=4, threads=2)
+        next(FCs)
+        FCs.close()
+        # The buffer of the generator and one buffer per thread.
+        self.assertGreater(len(buffers), 1)
+        self.assertTrue(all(buffer.closed for buffer in buffers))
+        self.assertIsNone(uff._afmfile)
+
+class TestLazyConversion(CurveAssertions, unittest.TestCase):
+
+    def setUp(self):
+        self.JPK_FV_FILE = loadfile(JPK_FV_PATH, lazy_conversion=True)
+        self.expected = loadfile(JPK_FV_PATH)
+
+    def test_channels_converted_on_access(self):
+        FC = self.JPK_FV_FILE.getcurve(3)
+        expected_segments = dict(self.expected.getcurve(3).get_segments())
+        for segid, segment in FC.get_segments():
+            data = segment.segment_formated_data
+            self.assertIsInstance(data, LazyDict)
+            keys = list(data)
+            self.assertTrue(keys)
+            self.assertFalse(any(data.is_loaded(key) for key in keys))
+            for i, key in enumerate(keys):
+                values = data[key]
+                self.assertTrue(data.is_loaded(key))
+                # The other channels are still pending.
+                self.assertFalse(any(data.is_loaded(other) for other in keys[i + 1:]))
+                expected = expected_segments[segid].segment_formated_data[key]
+                self.assertEqual(values.dtype, expected.dtype)
+                np.testing.assert_array_equal(values, expected)
+
+    def test_pickled_lazy_curve(self):
+        FC = pickle.loads(pickle.dumps(self.JPK_FV_FILE.getcurve(5)))
+        for _, segment in FC.get_segments():
+            data = segment.segment_formated_data
+            self.assertFalse(any(data.is_loaded(key) for key in data))
+        self.assertSameCurve(FC, self.expected.getcurve(5))
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        patcher = mock.patch.dict(os.environ, {'PYFMREADER_CACHE_DIR': os.path.join(self.tmpdir.name, 'cache')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.filepath = os.path.join(self.tmpdir.name, os.path.basename(JPK_FV_PATH))
+        shutil.copy(JPK_FV_PATH, self.filepath)
+
+    def loadfile(self, **kwargs):
+        # Count the headers parsed while loading the file.
+        with mock.patch.object(loadjpkfile, 'parseJPKheader', wraps=loadjpkfile.parseJPKheader) as parseheader:
+            uff = loadfile(self.filepath, metadata_cache=True, **kwargs)
+        return uff, parseheader.call_count
+
+    def test_cache_hit(self):
+        uff, parsed = self.loadfile()
+        self.assertEqual(parsed, 1)
+        self.assertTrue(os.path.isfile(getmetadatacachepath(self.filepath)))
+        cached, parsed = self.loadfile()
+        self.assertEqual(parsed, 0)
+        self.assertEqual(cached.filemetadata['curve_properties'].keys(), uff.filemetadata['curve_properties'].keys())
+        np.testing.assert_array_equal(cached.getpiezoimg(), uff.getpiezoimg())
+        FC = cached.getcurve(2)
+        for (_, segment), (_, expected) in zip(FC.get_segments(), uff.getcurve(2).get_segments()):
+            for key, values in expected.segment_formated_data.items():
+                np.testing.assert_array_equal(segment.segment_formated_data[key], values)
+
+    def test_cache_invalidated_when_file_changes(self):
+        self.loadfile()
+        stat = os.stat(self.filepath)
+        os.utime(self.filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        self.assertEqual(self.loadfile()[1], 1)
+        with open(self.filepath, 'ab') as f:
+            f.write(b'\0')
+        self.assertEqual(self.loadfile()[1], 1)
+        self.assertEqual(self.loadfile()[1], 0)
+
+    def test_lazy_cache_not_used_by_full_load(self):
+        self.loadfile(lazy=True)
+        self.assertEqual(self.loadfile(lazy=True)[1], 0)
+        uff, parsed = self.loadfile()
+        self.assertEqual(parsed, 1)
+        self.assertEqual(len(uff.filemetadata['curve_properties']), uff.filemetadata['Entry_tot_nb_curve'])
+        # The full metadata replaces the lazy one, and is used by lazy loads too.
+        self.assertEqual(self.loadfile()[1], 0)
+        self.assertEqual(self.loadfile(lazy=True)[1], 0)
+
+    def test_corrupt_cache_is_a_miss(self):
+        self.loadfile()
+        with open(getmetadatacachepath(self.filepath), 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertIsNone(loadmetadatacache(self.filepath))
+        self.assertEqual(self.loadfile()[1], 1)
+        self.assertEqual(self.loadfile()[1], 0)
+
+    def test_unpicklable_metadata_not_cached(self):
+        savemetadatacache(self.filepath, {'lock': threading.Lock()})
+        self.assertIsNone(loadmetadatacache(self.filepath))
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir.name, 'cache')), [])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file